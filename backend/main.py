@@ -1,15 +1,17 @@
 """
 FastAPI main application for SecureDoc Flow Privacy Proxy.
 """
+import hashlib
 import os
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from backend.routers import securedoc, billing
+from backend.utils import env_bool as _env_bool
 
 # Configure logging to exclude request bodies
 logging.basicConfig(
@@ -23,12 +25,17 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Application lifespan events."""
     logger.info("Starting SecureDoc Flow Privacy Proxy")
+    billing.open_stripe_http_client()
     yield
     try:
         # Close shared HTTP clients (best-effort)
         await securedoc.llm_client.close()
     except Exception:
         logger.warning("Failed to close LLM client")
+    try:
+        billing.close_stripe_http_client()
+    except Exception:
+        logger.warning("Failed to close Stripe HTTP client")
     logger.info("Shutting down SecureDoc Flow Privacy Proxy")
 
 
@@ -36,24 +43,23 @@ app = FastAPI(
     title="SecureDoc Flow Privacy Proxy",
     description="MedTech AI Privacy Proxy with PHI anonymization",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 def _parse_csv_env(name: str) -> list[str]:
+    """Split a comma-separated env var; called once at import, not per request."""
     raw = os.getenv(name, "").strip()
     if not raw:
         return []
-    return [item.strip() for item in raw.split(",") if item.strip()]
-
+    items = (item.strip() for item in raw.split(","))
+    return [item for item in items if item]
 
-def _env_bool(name: str, default: bool = False) -> bool:
-    raw = os.getenv(name)
-    if raw is None:
-        return default
-    return raw.strip().lower() in {"1", "true", "yes", "on"}
 
-
-# CORS (secure-by-default): disabled unless explicitly configured
+# CORS (secure-by-default): disabled unless explicitly configured.
+# Note: CORSMiddleware and the exception handler below (ServerErrorMiddleware)
+# are pure ASGI. Avoid BaseHTTPMiddleware-based middleware here; it adds a task
+# and Request/Response objects to every request.
 cors_allow_origins = _parse_csv_env("CORS_ALLOW_ORIGINS")
 cors_allow_credentials = _env_bool("CORS_ALLOW_CREDENTIALS", default=False)
 
@@ -117,25 +123,38 @@ def _ui_file(name: str) -> Path:
     return _REPO_ROOT / name
 
 
+# Static demo pages are read once and served from memory: name -> (content, ETag)
+_ui_cache: dict[str, tuple[bytes, str]] = {}
+
+
+def _ui_response(request: Request, name: str) -> Response:
+    cached = _ui_cache.get(name)
+    if cached is None:
+        path = _ui_file(name)
+        if not path.is_file():
+            return JSONResponse(status_code=404, content={"error": "Not found"})
+        content = path.read_bytes()
+        etag = f'"{hashlib.sha1(content, usedforsecurity=False).hexdigest()}"'
+        cached = _ui_cache[name] = (content, etag)
+
+    content, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="text/html", headers=headers)
+
+
 @app.get("/ui/version1")
-async def ui_version1():
-    path = _ui_file("Version 1.html")
-    if not path.exists():
-        return JSONResponse(status_code=404, content={"error": "Not found"})
-    return FileResponse(path)
+async def ui_version1(request: Request):
+    return _ui_response(request, "Version 1.html")
 
 
 @app.get("/ui/version2")
-async def ui_version2():
-    path = _ui_file("Version 2.html")
-    if not path.exists():
-        return JSONResponse(status_code=404, content={"error": "Not found"})
-    return FileResponse(path)
+async def ui_version2(request: Request):
+    return _ui_response(request, "Version 2.html")
 
 
 @app.get("/ui/presentation")
-async def ui_presentation():
-    path = _ui_file("Präsentation.html")
-    if not path.exists():
-        return JSONResponse(status_code=404, content={"error": "Not found"})
-    return FileResponse(path)
+async def ui_presentation(request: Request):
+    return _ui_response(request, "Präsentation.html")
@@ -1,9 +1,13 @@
 """
 Pydantic models for request/response schemas.
 """
+import re
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional
 
+# Control characters other than tab, newline and carriage return
+_INVALID_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
 
 class SecureDocRequest(BaseModel):
     """Request model for /v1/securedoc/generate endpoint."""
@@ -15,10 +19,9 @@ class SecureDocRequest(BaseModel):
     @classmethod
     def validate_text(cls, v: str) -> str:
         """Validate text doesn't contain control characters."""
-        # Allow newlines, tabs, but not other control characters
-        for char in v:
-            if ord(char) < 32 and char not in ['\n', '\t', '\r']:
-                raise ValueError('Text contains invalid control characters')
+        # Allow newlines, tabs, but not other control characters (single C-level scan)
+        if _INVALID_CONTROL_CHARS.search(v):
+            raise ValueError('Text contains invalid control characters')
         return v
 
 
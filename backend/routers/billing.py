@@ -3,6 +3,7 @@ Billing router for Stripe webhook handling.
 """
 from fastapi import APIRouter, Request, HTTPException, Header
 import stripe
+import requests
 import logging
 import time
 from typing import Optional
@@ -28,11 +29,43 @@ if stripe_settings.stripe_api_key:
     stripe.api_key = stripe_settings.stripe_api_key
 
 
+_stripe_session: Optional[requests.Session] = None
+
+
+def open_stripe_http_client() -> None:
+    """Install one pooled HTTP client for outbound Stripe API calls.
+
+    Webhook verification itself is local; this only matters for API calls
+    (e.g. when provisioning access), which then reuse TLS connections.
+    """
+    global _stripe_session
+    # One explicit Session: RequestsClient would otherwise open one per thread
+    _stripe_session = requests.Session()
+    stripe.default_http_client = stripe.RequestsClient(session=_stripe_session)
+
+
+def close_stripe_http_client() -> None:
+    """Close the shared Stripe HTTP session's connection pool."""
+    global _stripe_session
+    session, _stripe_session = _stripe_session, None
+    stripe.default_http_client = None
+    if session is not None:
+        session.close()
+
+
 # LRU cache for processed events (idempotency)
 MAX_PROCESSED_EVENTS = 1000
 processed_events = OrderedDict()
 
 
+def _remember_event(event_id: str, timestamp: int) -> None:
+    """Mark an event as processed, evicting the least recently seen entry if full."""
+    processed_events[event_id] = timestamp
+    processed_events.move_to_end(event_id)
+    if len(processed_events) > MAX_PROCESSED_EVENTS:
+        processed_events.popitem(last=False)
+
+
 @router.post("/billing/stripe/webhook")
 async def stripe_webhook(
     request: Request,
@@ -58,7 +91,9 @@ async def stripe_webhook(
         logger.warning("Missing Stripe signature")
         raise HTTPException(status_code=400, detail="Missing Stripe signature")
     
-    if not stripe_settings.stripe_webhook_secret:
+    # Fail closed before reading the body; Stripe encodes the str secret itself
+    webhook_secret = stripe_settings.stripe_webhook_secret
+    if not webhook_secret:
         logger.warning("Stripe webhook secret not configured")
         raise HTTPException(status_code=500, detail="Webhook secret not configured")
     
@@ -70,7 +105,7 @@ async def stripe_webhook(
         event = stripe.Webhook.construct_event(
             payload=payload,
             sig_header=stripe_signature,
-            secret=stripe_settings.stripe_webhook_secret
+            secret=webhook_secret
         )
         
         # Check timestamp for replay protection (Stripe uses 300s tolerance)
@@ -85,6 +120,8 @@ async def stripe_webhook(
         # Idempotency check with LRU cache
         event_id = event['id']
         if event_id in processed_events:
+            # Refresh recency so replayed events stay cached (LRU, not FIFO)
+            processed_events.move_to_end(event_id)
             logger.info(f"Event {event_id} already processed (idempotent)")
             return {"status": "success", "message": "Event already processed"}
         
@@ -102,12 +139,7 @@ async def stripe_webhook(
             logger.info("Processing payment (event_id=%s)", event_id)
         
         # Mark event as processed with LRU eviction
-        processed_events[event_id] = current_timestamp
-        
-        # Maintain LRU cache size
-        if len(processed_events) > MAX_PROCESSED_EVENTS:
-            # Remove oldest entry (FIFO in OrderedDict)
-            processed_events.popitem(last=False)
+        _remember_event(event_id, current_timestamp)
         
         return {"status": "success"}
         
@@ -1,17 +1,25 @@
 """
 SecureDoc router for PHI-protected document generation.
 """
+import asyncio
 import hashlib
+import hmac
+import math
 import os
 import secrets
 import time
+from collections import OrderedDict
+from typing import NamedTuple, NoReturn, Optional
 from fastapi import APIRouter, HTTPException, Depends, Header, Request, Security
 import logging
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import APIKeyHeader
 
 from backend.models.schemas import SecureDocRequest, SecureDocResponse
-from backend.services.anonymization import AnonymizationService
+from backend.services import anonymization
+from backend.services.anonymization import StreamingReidentifier, anonymize, reidentify
 from backend.services.llm_client import LLMClient
+from backend.utils import env_bool as _env_bool
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -23,14 +31,71 @@ api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 
 _RATE_SALT = secrets.token_hex(16)
-_rate_state: dict[str, tuple[float, float]] = {}
 
+# Token buckets ordered by last use: identity -> (tokens, last_seen).
+# Identity is "key:<api key>" or a salted int hash of the client address.
+MAX_RATE_STATE_ENTRIES = 10_000
+_rate_state: "OrderedDict[str | int, tuple[float, float]]" = OrderedDict()
 
-def _env_bool(name: str, default: bool) -> bool:
-    raw = os.getenv(name)
-    if raw is None:
-        return default
-    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+def _sweep_rate_state(now: float, rate_per_sec: float, burst: float) -> None:
+    """Drop idle buckets that have refilled completely and cap the table size.
+
+    A full bucket behaves exactly like a missing one, so evicting it is free.
+    Buckets are kept in last-use order; the sweep stops at the first one that
+    is still draining, which keeps it amortized O(1) per request.
+    """
+    while _rate_state:
+        tokens, last = next(iter(_rate_state.values()))
+        if tokens + (now - last) * rate_per_sec < burst:
+            break
+        _rate_state.popitem(last=False)
+
+    while len(_rate_state) > MAX_RATE_STATE_ENTRIES:
+        _rate_state.popitem(last=False)
+
+
+def _key_digest(key: str) -> bytes:
+    """Fixed-length digest of an API key, so comparisons do not leak its length."""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=32).digest()
+
+
+class _SecureDocConfig(NamedTuple):
+    """SECUREDOC_* settings, parsed once instead of on every request."""
+    require_api_key: bool
+    # BLAKE2b digest of SECUREDOC_API_KEY (None if unset), computed once
+    api_key_digest: Optional[bytes]
+    rate_limit_enabled: bool
+    # None if SECUREDOC_RATE_LIMIT_RPS/BURST are not valid floats (fail closed)
+    rate_limit_rps: Optional[float]
+    rate_limit_burst: Optional[float]
+
+
+def _load_config() -> _SecureDocConfig:
+    try:
+        rate_per_sec = float(os.getenv("SECUREDOC_RATE_LIMIT_RPS", "2"))
+        burst = float(os.getenv("SECUREDOC_RATE_LIMIT_BURST", "5"))
+    except ValueError:
+        rate_per_sec = burst = None
+
+    api_key = os.getenv("SECUREDOC_API_KEY", "").strip()
+
+    return _SecureDocConfig(
+        require_api_key=_env_bool("SECUREDOC_REQUIRE_API_KEY", default=True),
+        api_key_digest=_key_digest(api_key) if api_key else None,
+        rate_limit_enabled=_env_bool("SECUREDOC_RATE_LIMIT_ENABLED", default=True),
+        rate_limit_rps=rate_per_sec,
+        rate_limit_burst=burst,
+    )
+
+
+_config = _load_config()
+
+
+def _reload_config() -> None:
+    """Re-read SECUREDOC_* environment variables (e.g. after changing them in tests)."""
+    global _config
+    _config = _load_config()
 
 
 def _require_api_key(
@@ -42,19 +107,29 @@ def _require_api_key(
     - If SECUREDOC_REQUIRE_API_KEY=true and SECUREDOC_API_KEY is missing -> 503.
     - If key required and missing/invalid -> 401.
     """
-    require = _env_bool("SECUREDOC_REQUIRE_API_KEY", default=True)
-    expected = os.getenv("SECUREDOC_API_KEY", "").strip()
-
-    if not require:
+    config = _config
+    if not config.require_api_key:
         return ""
 
-    if not expected:
+    if config.api_key_digest is None:
         raise HTTPException(status_code=503, detail="Auth misconfigured")
 
-    if not x_api_key or x_api_key.strip() != expected:
+    provided = (x_api_key or "").strip()
+    # Constant-time comparison of equal-length digests: leaks neither how much
+    # of the key matched nor its length; the expected side is hashed once
+    if not provided or not hmac.compare_digest(_key_digest(provided), config.api_key_digest):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    return x_api_key.strip()
+    return provided
+
+
+def _raise_rate_limited(wait_seconds: float) -> NoReturn:
+    """Raise 429; Retry-After is whole seconds (rounded up, at least 1)."""
+    raise HTTPException(
+        status_code=429,
+        detail="Too Many Requests",
+        headers={"Retry-After": str(max(1, math.ceil(wait_seconds)))},
+    )
 
 
 def _enforce_rate_limit(request: Request, api_key: str) -> None:
@@ -63,15 +138,15 @@ def _enforce_rate_limit(request: Request, api_key: str) -> None:
     Best practice notes:
     - In production, use a shared store (Redis) to enforce limits across replicas.
     - We avoid storing raw IPs by hashing with a per-process salt.
+    - Only `request.client.host` is read (and only when there is no API key).
     """
-    enabled = _env_bool("SECUREDOC_RATE_LIMIT_ENABLED", default=True)
-    if not enabled:
+    config = _config
+    if not config.rate_limit_enabled:
         return
 
-    try:
-        rate_per_sec = float(os.getenv("SECUREDOC_RATE_LIMIT_RPS", "2"))
-        burst = float(os.getenv("SECUREDOC_RATE_LIMIT_BURST", "5"))
-    except ValueError:
+    rate_per_sec = config.rate_limit_rps
+    burst = config.rate_limit_burst
+    if rate_per_sec is None or burst is None:
         raise HTTPException(status_code=503, detail="Rate limit misconfigured")
 
     if rate_per_sec <= 0 or burst <= 0:
@@ -82,8 +157,8 @@ def _enforce_rate_limit(request: Request, api_key: str) -> None:
         identity = f"key:{api_key}"
     else:
         client_host = getattr(getattr(request, "client", None), "host", "") or "unknown"
-        digest = hashlib.sha256(f"{_RATE_SALT}:{client_host}".encode("utf-8")).hexdigest()[:16]
-        identity = f"ip:{digest}"
+        # Salted builtin hash: an int key, no raw IP kept, no per-request SHA-256
+        identity = hash((_RATE_SALT, client_host))
 
     now = time.monotonic()
     tokens, last = _rate_state.get(identity, (burst, now))
@@ -92,15 +167,12 @@ def _enforce_rate_limit(request: Request, api_key: str) -> None:
     tokens = min(burst, tokens + elapsed * rate_per_sec)
 
     if tokens < 1.0:
-        retry_after = max(1, int((1.0 - tokens) / rate_per_sec) if rate_per_sec > 0 else 1)
-        raise HTTPException(
-            status_code=429,
-            detail="Too Many Requests",
-            headers={"Retry-After": str(retry_after)},
-        )
+        _raise_rate_limited((1.0 - tokens) / rate_per_sec)
 
     tokens -= 1.0
     _rate_state[identity] = (tokens, now)
+    _rate_state.move_to_end(identity)
+    _sweep_rate_state(now, rate_per_sec, burst)
 
 
 @router.post(
@@ -132,29 +204,27 @@ async def generate_securedoc(
     Returns:
         SecureDocResponse with output_text and status
     """
-    # Create a new anonymization service instance for each request (thread-safe)
-    anonymization_service = AnonymizationService()
-    
+    # Anonymization is stateless: mappings live only in this request's locals
     try:
         # Rate-limit only after the request body is validated (422 must win over 429)
         _enforce_rate_limit(http_request, _auth)
         # Avoid logging request fields (may contain sensitive/personal data)
         logger.info("Processing securedoc request")
         
-        # Step 1: Anonymize input text
-        anonymized_text, mappings = anonymization_service.anonymize(request.text)
+        # Step 1: Anonymize input text (CPU-bound; keep it off the event loop)
+        anonymized_text, mappings = await asyncio.to_thread(anonymize, request.text)
         logger.info("Text anonymized successfully")
         
         # Step 2: Call LLM with ONLY anonymized text
         llm_response = await llm_client.generate(anonymized_text, request.task)
         logger.info("LLM response received")
         
-        # Step 3: Re-identify the LLM response
-        reidentified_response = anonymization_service.reidentify(llm_response, mappings)
+        # Step 3: Re-identify the LLM response (CPU-bound; keep it off the event loop)
+        reidentified_response = await asyncio.to_thread(reidentify, llm_response, mappings)
         logger.info("Response re-identified successfully")
         
-        # Step 4: Clear session data (critical for privacy)
-        anonymization_service.clear_session()
+        # Step 4: Drop the mappings (critical for privacy)
+        mappings.clear()
         
         return SecureDocResponse(
             output_text=reidentified_response,
@@ -163,13 +233,107 @@ async def generate_securedoc(
         
     except HTTPException:
         # Preserve explicit HTTP errors (e.g., 429 rate limit, 503 misconfig)
-        anonymization_service.clear_session()
         raise
     except ValueError:
         logger.error("Validation error")
         raise HTTPException(status_code=400, detail="Invalid request")
     except Exception as e:
         logger.error(f"Error processing request: {type(e).__name__}")
-        # Clear session on error too
-        anonymization_service.clear_session()
         raise HTTPException(status_code=500, detail="Error processing request")
+
+
+@router.post(
+    "/securedoc/generate/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/plain": {}}, "description": "Re-identified LLM output, streamed"},
+        401: {"description": "Unauthorized (missing/invalid X-API-Key)"},
+        429: {"description": "Too Many Requests (rate limit exceeded)", "headers": {"Retry-After": {"schema": {"type": "string"}}}},
+        503: {"description": "Misconfiguration (missing required env vars)"},
+    },
+)
+async def generate_securedoc_stream(
+    request: SecureDocRequest,
+    http_request: Request,
+    _auth: str = Security(_require_api_key),
+):
+    """
+    Streaming variant of /securedoc/generate.
+    
+    Same PHI protection, but the LLM response is re-identified chunk by chunk
+    and sent as it arrives. Placeholder validation runs at the end of the
+    stream; once output has started, a missing placeholder is only logged.
+    
+    With REIDENTIFY_FAIL_ON_MISSING_PLACEHOLDERS enabled the response is
+    buffered and validated before the first byte is sent (fail closed).
+    """
+    _enforce_rate_limit(http_request, _auth)
+    logger.info("Processing streaming securedoc request")
+    
+    try:
+        anonymized_text, mappings = await asyncio.to_thread(anonymize, request.text)
+    except ValueError:
+        logger.error("Validation error")
+        raise HTTPException(status_code=400, detail="Invalid request")
+    
+    chunks = llm_client.generate_stream(anonymized_text, request.task)
+    
+    if anonymization.FAIL_ON_MISSING_PLACEHOLDERS:
+        # Fail closed: a missing placeholder must become a 400, which is only
+        # possible before any output has been sent
+        try:
+            llm_response = "".join([chunk async for chunk in chunks])
+            reidentified_response = await asyncio.to_thread(
+                reidentify, llm_response, mappings, fail_on_missing=True
+            )
+        except ValueError:
+            logger.error("Validation error")
+            raise HTTPException(status_code=400, detail="Invalid request")
+        except Exception as e:
+            logger.error(f"Error processing request: {type(e).__name__}")
+            raise HTTPException(status_code=500, detail="Error processing request")
+        finally:
+            await chunks.aclose()
+            mappings.clear()
+        logger.info("Buffered response re-identified successfully")
+        return Response(reidentified_response, media_type="text/plain; charset=utf-8")
+    
+    # Wait for the first chunk so upstream failures still become a 500
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = ""
+    except Exception as e:
+        # Release the upstream stream (and its pooled connection) right away
+        await chunks.aclose()
+        mappings.clear()
+        logger.error(f"Error processing request: {type(e).__name__}")
+        raise HTTPException(status_code=500, detail="Error processing request")
+    
+    async def _stream():
+        reidentifier = StreamingReidentifier(mappings, fail_on_missing=False)
+        try:
+            out = reidentifier.feed(first_chunk)
+            if out:
+                yield out
+            async for chunk in chunks:
+                out = reidentifier.feed(chunk)
+                if out:
+                    yield out
+            tail = reidentifier.finish()
+            if tail:
+                yield tail
+            logger.info("Streamed response re-identified successfully")
+        except Exception as e:
+            # Headers are already sent: abort the transfer so a truncated
+            # document is never mistaken for a complete one (no details leaked)
+            logger.error(f"Error streaming response: {type(e).__name__}")
+            raise RuntimeError("stream aborted") from None
+        finally:
+            # Close the upstream stream even if the client disconnected early;
+            # otherwise its pooled connection stays checked out until GC
+            await chunks.aclose()
+            # Drop the mappings (critical for privacy)
+            mappings.clear()
+    
+    return StreamingResponse(_stream(), media_type="text/plain; charset=utf-8")
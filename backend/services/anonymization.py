@@ -1,228 +1,547 @@
 """
 In-memory anonymization service with collision-resistant placeholders.
 
+The module-level `anonymize` / `reidentify` functions are stateless: all
+per-request state (salt, mappings) lives in locals. `AnonymizationService`
+wraps them for callers that want a session object.
+
 Improvements:
 - Position-based replacement to avoid duplicate text issues
 - Placeholder validation in re-identification
 - Enhanced pattern detection with compiled regex for performance
+- Re-identification with one precompiled placeholder regex
+- Stateless functions; no per-request object construction on the hot path
 """
-import os
 import re
 import hashlib
+import itertools
 import secrets
-from typing import Dict, Tuple, Set, List, NamedTuple
-from dataclasses import dataclass
+from typing import Dict, Tuple, Set, List, Optional
 import logging
 
+from backend.utils import env_bool as _env_bool
+
 logger = logging.getLogger(__name__)
 
+# Session salts only need to be unique per request and unpredictable from outside
+# the process: one random nonce per process plus a counter avoids an OS RNG read
+# for every request.
+_PROCESS_NONCE = secrets.token_hex(8)
+_SALT_COUNTER = itertools.count()
+
+
+def _new_session_salt() -> str:
+    """Return a fresh, process-unique session salt."""
+    return f"{_PROCESS_NONCE}{next(_SALT_COUNTER):x}"
+
+
+def _fail_on_missing_from_env() -> bool:
+    return _env_bool("REIDENTIFY_FAIL_ON_MISSING_PLACEHOLDERS", default=False)
+
+
+# Read once at import; runtime env changes are not supported on the request path
+FAIL_ON_MISSING_PLACEHOLDERS = _fail_on_missing_from_env()
+
+
+def _combine_patterns(patterns: Dict[str, re.Pattern]) -> re.Pattern:
+    """
+    Fuse category patterns into one alternation with a named group per category.
+
+    Each pattern keeps its own flags via a scoped inline group, so e.g. the
+    case-sensitive name pattern is unaffected by IGNORECASE on the others.
+    Alternatives are tried in dict order, so earlier categories win ties.
+    """
+    branches = []
+    for category, pattern in patterns.items():
+        flags = "i" if pattern.flags & re.IGNORECASE else ""
+        branches.append(f"(?P<{category}>(?{flags}:{pattern.pattern}))")
+    return re.compile("|".join(branches))
+
+
+# Pre-compiled regex patterns for better performance.
+BASE_PATTERNS = {
+    # Date formats (best-effort):
+    # - EU: 31.12.2025 / 31-12-25 / 31/12/2025
+    # - ISO: 2025-12-31 / 2025/12/31 / 2025.12.31
+    # - US: 12/31/2025
+    # - Month names (DE/EN): 3 Jan 2026, 3. Januar 2026
+    'date': re.compile(
+        r'\b(?:'
+        r'(?:0?[1-9]|[12]\d|3[01])[\./\-](?:0?[1-9]|1[0-2])[\./\-](?:\d{2}|\d{4})'
+        r'|(?:\d{4})[\./\-](?:0?[1-9]|1[0-2])[\./\-](?:0?[1-9]|[12]\d|3[01])'
+        r'|(?:0?[1-9]|1[0-2])/(?:0?[1-9]|[12]\d|3[01])/(?:\d{2}|\d{4})'
+        r'|(?:0?[1-9]|[12]\d|3[01])\.?\s*'
+        r'(?:Jan(?:uar)?|Feb(?:ruar)?|Mär(?:z)?|Maerz|Apr(?:il)?|Mai|Jun(?:i)?|Jul(?:i)?|Aug(?:ust)?|Sep(?:tember)?|Okt(?:ober)?|Nov(?:ember)?|Dez(?:ember)?'
+        r'|January|February|March|April|May|June|July|August|September|October|November|December)\s*'
+        r'(?:\d{2}|\d{4})'
+        r')\b',
+        re.IGNORECASE,
+    ),
+    'id': re.compile(r'\b(?:MRN|ID|SSN)[:\s-]*(?:\d{3}-\d{2}-\d{4}|\d{9}|\w+\d{4,})\b', re.IGNORECASE),
+    'phone': re.compile(r'\b(?:\+?1[-.\s]?)?\(?[0-9]{3}\)?[-.\s]?[0-9]{3}[-.\s]?[0-9]{4}\b'),
+    'name': re.compile(r'\b(?:Dr\.|Mr\.|Mrs\.|Ms\.)\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)?\b'),
+}
+
+# --- DSGVO Art. 9 (Special Categories of Personal Data) ---
+# Best-effort detection: these are high-sensitivity indicators.
+# In medical contexts, most content can be Art.9; this layer is for common
+# structured markers (e.g., codes) and explicit labels.
+ART9_PATTERNS = {
+    'art9_health_icd10': re.compile(r'\b[A-TV-Z][0-9]{2}(?:\.[0-9A-TV-Z]{1,2})?\b'),
+    'art9_genetic_biometric': re.compile(r'\b(?:DNA|genetisch(?:e|er|es)?|biometrisch(?:e|er|es)?|Fingerabdruck|Gesichtserkennung)\b', re.IGNORECASE),
+    'art9_religion': re.compile(r'\b(?:katholisch|evangelisch|muslim(?:isch)?|jüdisch|buddhist(?:isch)?|hindu(?:istisch)?|atheist(?:isch)?)\b', re.IGNORECASE),
+    'art9_politics': re.compile(r'\b(?:CDU|CSU|SPD|FDP|AfD|Die\s+Linke|GRÜNE|Grüne)\b', re.IGNORECASE),
+    'art9_union': re.compile(r'\b(?:Gewerkschaft|ver\.di|IG\s+Metall|IG\s+BCE)\b', re.IGNORECASE),
+    'art9_sexuality': re.compile(r'\b(?:sexuelle\s+Orientierung|homosexuell|heterosexuell|bisexuell|transgender|queer)\b', re.IGNORECASE),
+}
+
+
+# Emails are found outside the combined regex, anchored on each '@' (see
+# `_email_candidates`). As a regex alternative (\b[local chars]+@...) every start
+# position in a long run like 'a.a.a.' rescans to its end (quadratic time), and
+# bounding the run instead misses addresses with long local parts.
+EMAIL_CATEGORY = 'email'
+_EMAIL_LOCAL_RUN = re.compile(r'[A-Za-z0-9._%+-]+')  # matched on the reversed text
+_EMAIL_DOMAIN = re.compile(r'[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_WORD_BOUNDARY = re.compile(r'\b')
+
+
+def _build_patterns(include_art9: bool) -> Dict[str, re.Pattern]:
+    """Return the active category patterns (base categories first, so they win ties)."""
+    if include_art9:
+        return {**BASE_PATTERNS, **ART9_PATTERNS}
+    return dict(BASE_PATTERNS)
+
+
+# Art. 9 detection is on by default (privacy-by-default). Deployments that do
+# not need it can set ANONYMIZE_ART9=false to drop those branches from the scan.
+ANONYMIZE_ART9 = _env_bool("ANONYMIZE_ART9", default=True)
+PATTERNS = _build_patterns(ANONYMIZE_ART9)
+
+# All categories in one regex: a single scan over the text instead of one per pattern
+COMBINED_PATTERN = _combine_patterns(PATTERNS)
+
+# Every category outside this set needs a digit, '@' or a title (Dr./Mr./Mrs./Ms.)
+# to match. Keep this in sync with BASE_PATTERNS / ART9_PATTERNS.
+_KEYWORD_CATEGORIES = (
+    'art9_genetic_biometric',
+    'art9_religion',
+    'art9_politics',
+    'art9_union',
+    'art9_sexuality',
+)
+
+# Cheap prescan: if it misses, only the keyword categories can match
+_PHI_HINT = re.compile(r'[@\d]|\b(?:Dr|Mr|Mrs|Ms)\.')
+
+# Fused keyword-only pattern for texts that fail the prescan (None if no such categories)
+_KEYWORD_PATTERNS = {k: p for k, p in PATTERNS.items() if k in _KEYWORD_CATEGORIES}
+KEYWORD_PATTERN = _combine_patterns(_KEYWORD_PATTERNS) if _KEYWORD_PATTERNS else None
+
+# Placeholder prefix per category, e.g. 'date' -> '[DATE_'
+_PLACEHOLDER_PREFIX = {category: f"[{category.upper()}_" for category in (EMAIL_CATEGORY, *PATTERNS)}
+
+# Hash suffix per category, pre-encoded: 'date' -> b':date'
+_CATEGORY_HASH_SUFFIX = {
+    category: f":{category}".encode('ascii') for category in (EMAIL_CATEGORY, *PATTERNS)
+}
+
+# Any placeholder `_generate_placeholder` can issue (for every known category,
+# so mappings stay restorable regardless of ANONYMIZE_ART9).
+_PLACEHOLDER_RE = re.compile(
+    r'\[(?:'
+    + '|'.join(
+        re.escape(category.upper())
+        for category in (EMAIL_CATEGORY, *BASE_PATTERNS, *ART9_PATTERNS)
+    )
+    + r')_[0-9a-f]{8}(?:_[0-9]+)?\]'
+)
+
+
+def _generate_placeholder(
+    original: str,
+    category: str,
+    salted: "hashlib.blake2b",
+    mappings: Dict[str, str],
+    cache: Dict[Tuple[str, str], str],
+) -> str:
+    """
+    Generate a collision-resistant placeholder.
+    
+    Repeated occurrences of the same value (per category) reuse the placeholder
+    from the first occurrence, so each unique value is hashed only once.
+    
+    Args:
+        original: Original PHI value
+        category: Type of PHI (name, date, id, etc.)
+        salted: BLAKE2b hasher keyed with the session salt (copied, not updated)
+        mappings: Placeholders already issued in this session
+        cache: (original, category) -> placeholder for this session
+    
+    Returns:
+        Unique placeholder string
+    """
+    cache_key = (original, category)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Create a hash of the original value with session salt for uniqueness.
+    # BLAKE2b with a 4-byte digest yields the 8 hex chars directly (no truncation);
+    # the salt is its key, so each value only costs a copy of the keyed state.
+    hasher = salted.copy()
+    hasher.update(original.encode('utf-8'))
+    hasher.update(_CATEGORY_HASH_SUFFIX[category])
+    hash_digest = hasher.hexdigest()
+    
+    # Generate placeholder with category prefix
+    prefix = _PLACEHOLDER_PREFIX[category]
+    base_placeholder = f"{prefix}{hash_digest}]"
+    
+    # Ensure uniqueness
+    placeholder = base_placeholder
+    counter = 1
+    while placeholder in mappings:
+        placeholder = f"{prefix}{hash_digest}_{counter}]"
+        counter += 1
+    
+    cache[cache_key] = placeholder
+    return placeholder
+
+
+def _email_candidates(text: str) -> List[Tuple[int, int, int]]:
+    """
+    Return (local-part run start, '@' index, end) for each '@' followed by a domain.
+
+    The local part is the maximal run of local-part characters before the '@',
+    found by matching forward on the reversed text. Runs (and domains) cannot
+    cross an '@', so all candidates together cost one linear pass.
+    """
+    candidates: List[Tuple[int, int, int]] = []
+    at = text.find('@')
+    if at < 0:
+        return candidates
+
+    reversed_text = text[::-1]
+    length = len(text)
+    while at >= 0:
+        domain = _EMAIL_DOMAIN.match(text, at + 1)
+        if domain is not None:
+            local = _EMAIL_LOCAL_RUN.match(reversed_text, length - at)
+            if local is not None:
+                candidates.append((at - len(local.group()), at, domain.end()))
+        at = text.find('@', at + 1)
+    return candidates
+
+
+def _iter_phi(text: str, pattern: re.Pattern):
+    """
+    Yield (start, end, category) for each PHI match, left to right, non-overlapping.
+
+    Merges the `pattern` matches with the emails from `_email_candidates`. The
+    leftmost match wins; an email wins a tie, as it spans the whole address.
+    As with a `\\b[local chars]+@...` regex, an email starts at the
+    first word boundary in its local-part run that is not already consumed.
+    """
+    emails = _email_candidates(text)
+    email_index = 0
+    email_start = None  # start of emails[email_index] at the current position
+    pos = 0
+    regex_match = pattern.search(text)
+    while True:
+        while email_start is None and email_index < len(emails):
+            run_start, at, _ = emails[email_index]
+            if at >= pos:
+                boundary = _WORD_BOUNDARY.search(text, max(run_start, pos), at)
+                if boundary is not None and boundary.start() < at:
+                    email_start = boundary.start()
+                    break
+            email_index += 1
+
+        if email_start is not None and (regex_match is None or email_start <= regex_match.start()):
+            start, end, category = email_start, emails[email_index][2], EMAIL_CATEGORY
+            email_index += 1
+            email_start = None
+        elif regex_match is not None:
+            start, end = regex_match.span()
+            category = regex_match.lastgroup
+        else:
+            return
+
+        yield start, end, category
+
+        # Drop whatever overlaps the match just emitted and look again from its end
+        pos = end
+        if email_start is not None and email_start < pos:
+            email_start = None
+        if regex_match is not None and regex_match.start() < pos:
+            regex_match = pattern.search(text, pos)
+
+
+def _anonymize(text: str, salt: str) -> Tuple[str, Dict[str, str], Dict]:
+    """Anonymize `text` with the given salt; also returns statistics."""
+    mappings: Dict[str, str] = {}
+    cache: Dict[Tuple[str, str], str] = {}
+    by_category: Dict[str, int] = {}
+    stats = {'total_phi_elements': 0, 'by_category': by_category}
+    
+    # Texts without digits, '@' or titles cannot contain most categories: scan
+    # them with the much smaller keyword pattern, or not at all.
+    if _PHI_HINT.search(text):
+        pattern = COMBINED_PATTERN
+    elif KEYWORD_PATTERN is not None:
+        pattern = KEYWORD_PATTERN
+    else:
+        return text, mappings, stats
+    
+    salted = hashlib.blake2b(key=salt.encode('utf-8'), digest_size=4)
+    
+    # Single scan over the text; matches come non-overlapping in ascending
+    # order, so the output is built in the same left-to-right walk. Joining the
+    # parts once avoids copying the full text for every replacement
+    # (O(N + K) instead of O(N * K)).
+    parts: List[str] = []
+    cursor = 0
+    total = 0
+    for start, end, category in _iter_phi(text, pattern):
+        original = text[start:end]
+        
+        # Generate placeholder
+        placeholder = _generate_placeholder(original, category, salted, mappings, cache)
+        mappings[placeholder] = original
+        
+        parts.append(text[cursor:start])
+        parts.append(placeholder)
+        cursor = end
+
+        # Update statistics
+        by_category[category] = by_category.get(category, 0) + 1
+        total += 1
+
+    parts.append(text[cursor:])
+    anonymized_text = "".join(parts)
+
+    stats['total_phi_elements'] = total
+    
+    logger.info(
+        "Anonymized text: %d unique elements (categories=%s)",
+        len(mappings),
+        list(stats['by_category'].keys()),
+    )
+    return anonymized_text, mappings, stats
+
+
+def anonymize(text: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Anonymize PHI in text using pattern-based detection with position tracking.
+    
+    Uses position-based replacement to correctly handle duplicate text.
+    Scans once with the combined pattern, then builds the output in one forward pass.
+    Where categories overlap, the leftmost match wins; ties go to the earlier
+    category, except that an email wins any tie.
+    
+    Args:
+        text: Original text containing PHI
+    
+    Returns:
+        Tuple of (anonymized_text, mappings_dict)
+    """
+    anonymized_text, mappings, _ = _anonymize(text, _new_session_salt())
+    return anonymized_text, mappings
+
+
+def _uses_standard_placeholders(mappings: Dict[str, str]) -> bool:
+    """True if every key has the shape `_generate_placeholder` issues."""
+    return all(_PLACEHOLDER_RE.fullmatch(placeholder) for placeholder in mappings)
+
+
+def _key_alternation(mappings: Dict[str, str]) -> re.Pattern:
+    """One alternation over exactly these keys. Longest first to avoid partial matches."""
+    return re.compile("|".join(
+        re.escape(placeholder)
+        for placeholder in sorted(mappings, key=len, reverse=True)
+    ))
+
+
+def _restore_with_pattern(
+    text: str, pattern: re.Pattern, mappings: Dict[str, str], found: Set[str]
+) -> str:
+    """Replace hits of `pattern` that are mapping keys; adds each restored key to `found`."""
+    def _restore(m: re.Match) -> str:
+        placeholder = m.group(0)
+        original = mappings.get(placeholder)
+        if original is None:
+            return placeholder
+        found.add(placeholder)
+        return original
+
+    return pattern.sub(_restore, text)
+
+
+def _report_missing(mappings: Dict[str, str], found: Set[str], fail_on_missing: bool) -> int:
+    """Warn (or raise ValueError) about placeholders missing downstream; returns the count."""
+    missing_placeholders = [p for p in mappings if p not in found]
+    
+    if missing_placeholders:
+        logger.warning(
+            f"Re-identification warning: {len(missing_placeholders)} placeholder(s) "
+            f"not found in LLM response. They may have been modified or removed. "
+            f"First missing: {missing_placeholders[0]}"
+        )
+
+        if fail_on_missing:
+            raise ValueError("Missing placeholders in downstream response")
+    
+    return len(missing_placeholders)
 
-@dataclass
-class Match:
-    """Represents a PHI match with position information."""
-    start: int
-    end: int
-    original: str
-    placeholder: str
-    category: str
+
+def reidentify(
+    text: str,
+    mappings: Dict[str, str],
+    fail_on_missing: Optional[bool] = None,
+) -> str:
+    """
+    Re-identify anonymized text using provided mappings.
+    
+    Validates that all expected placeholders are present and warns if any are missing.
+    This helps detect if the LLM modified or removed placeholders.
+    
+    Args:
+        text: Anonymized text with placeholders
+        mappings: Dictionary mapping placeholders to original values
+        fail_on_missing: Raise ValueError if placeholders are missing
+            (default: REIDENTIFY_FAIL_ON_MISSING_PLACEHOLDERS, read at import)
+    
+    Returns:
+        Original text with PHI restored
+    """
+    if fail_on_missing is None:
+        fail_on_missing = FAIL_ON_MISSING_PLACEHOLDERS
+
+    # Restore originals in a single scan; the same scan records which
+    # placeholders were actually present in the downstream text.
+    found: Set[str] = set()
+    if not mappings:
+        reidentified_text = text
+    elif _uses_standard_placeholders(mappings):
+        # Usual case: scan with the precompiled placeholder shape, nothing to build
+        reidentified_text = _restore_with_pattern(text, _PLACEHOLDER_RE, mappings, found)
+    else:
+        # Mappings with non-standard keys: build an alternation for exactly these keys
+        reidentified_text = _restore_with_pattern(text, _key_alternation(mappings), mappings, found)
+    
+    missing = _report_missing(mappings, found, fail_on_missing)
+    
+    logger.info(
+        "Re-identified text using %d mappings (missing=%d)",
+        len(mappings),
+        missing,
+    )
+    return reidentified_text
+
+
+class StreamingReidentifier:
+    """
+    Re-identify text that arrives in chunks (e.g. a streamed LLM response).
+
+    `feed` returns the part of the text that is safe to emit: the last
+    `longest placeholder - 1` characters are held back, so a placeholder split
+    across chunks is restored once it is complete. `finish` flushes the rest
+    and validates placeholder presence like `reidentify`.
+    """
+
+    def __init__(self, mappings: Dict[str, str], fail_on_missing: Optional[bool] = None):
+        self.mappings = mappings
+        self.fail_on_missing = (
+            FAIL_ON_MISSING_PLACEHOLDERS if fail_on_missing is None else fail_on_missing
+        )
+        self.found: Set[str] = set()
+        self._buffer = ""
+        self._holdback = max(map(len, mappings), default=1) - 1
+        if not mappings:
+            self._pattern = None
+        elif _uses_standard_placeholders(mappings):
+            self._pattern = _PLACEHOLDER_RE
+        else:
+            self._pattern = _key_alternation(mappings)
+
+    def feed(self, chunk: str) -> str:
+        """Add `chunk`; return the re-identified text that can be emitted now."""
+        text = self._buffer + chunk
+        if self._pattern is None:
+            self._buffer = ""
+            return text
+
+        # Any placeholder starting before `cut` ends within `text` and is complete
+        cut = len(text) - self._holdback
+        if cut <= 0:
+            self._buffer = text
+            return ""
+
+        parts: List[str] = []
+        cursor = 0
+        for m in self._pattern.finditer(text):
+            start, end = m.span()
+            if start >= cut:
+                break
+            if end > cut:
+                cut = start
+                break
+            placeholder = m.group(0)
+            original = self.mappings.get(placeholder)
+            if original is None:
+                continue
+            parts.append(text[cursor:start])
+            parts.append(original)
+            cursor = end
+            self.found.add(placeholder)
+        parts.append(text[cursor:cut])
+        self._buffer = text[cut:]
+        return "".join(parts)
+
+    def finish(self) -> str:
+        """Flush held-back text and validate (may raise ValueError, see `reidentify`)."""
+        text, self._buffer = self._buffer, ""
+        if self._pattern is not None:
+            text = _restore_with_pattern(text, self._pattern, self.mappings, self.found)
+        _report_missing(self.mappings, self.found, self.fail_on_missing)
+        return text
 
 
 class AnonymizationService:
     """
     In-memory PHI anonymization service.
     
+    Session-style wrapper around the module-level `anonymize` / `reidentify`
+    functions: keeps the last mappings and statistics on the instance.
     Generates collision-resistant placeholders and maintains mappings in RAM only.
-    Uses position-based replacement to handle duplicate text correctly.
-    """
-    
-    # Pre-compiled regex patterns for better performance
-    PATTERNS = {
-        # Date formats (best-effort):
-        # - EU: 31.12.2025 / 31-12-25 / 31/12/2025
-        # - ISO: 2025-12-31 / 2025/12/31 / 2025.12.31
-        # - US: 12/31/2025
-        # - Month names (DE/EN): 3 Jan 2026, 3. Januar 2026
-        'date': re.compile(
-            r'\b(?:'
-            r'(?:0?[1-9]|[12]\d|3[01])[\./\-](?:0?[1-9]|1[0-2])[\./\-](?:\d{2}|\d{4})'
-            r'|(?:\d{4})[\./\-](?:0?[1-9]|1[0-2])[\./\-](?:0?[1-9]|[12]\d|3[01])'
-            r'|(?:0?[1-9]|1[0-2])/(?:0?[1-9]|[12]\d|3[01])/(?:\d{2}|\d{4})'
-            r'|(?:0?[1-9]|[12]\d|3[01])\.?\s*'
-            r'(?:Jan(?:uar)?|Feb(?:ruar)?|Mär(?:z)?|Maerz|Apr(?:il)?|Mai|Jun(?:i)?|Jul(?:i)?|Aug(?:ust)?|Sep(?:tember)?|Okt(?:ober)?|Nov(?:ember)?|Dez(?:ember)?'
-            r'|January|February|March|April|May|June|July|August|September|October|November|December)\s*'
-            r'(?:\d{2}|\d{4})'
-            r')\b',
-            re.IGNORECASE,
-        ),
-        'id': re.compile(r'\b(?:MRN|ID|SSN)[:\s-]*(\d{3}-\d{2}-\d{4}|\d{9}|\w+\d{4,})\b', re.IGNORECASE),
-        'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
-        'phone': re.compile(r'\b(?:\+?1[-.\s]?)?\(?([0-9]{3})\)?[-.\s]?([0-9]{3})[-.\s]?([0-9]{4})\b'),
-        'name': re.compile(r'\b(?:Dr\.|Mr\.|Mrs\.|Ms\.)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)?)\b'),
-
-        # --- DSGVO Art. 9 (Special Categories of Personal Data) ---
-        # Best-effort detection: these are high-sensitivity indicators.
-        # In medical contexts, most content can be Art.9; this layer is for common
-        # structured markers (e.g., codes) and explicit labels.
-        'art9_health_icd10': re.compile(r'\b[A-TV-Z][0-9]{2}(?:\.[0-9A-TV-Z]{1,2})?\b'),
-        'art9_genetic_biometric': re.compile(r'\b(?:DNA|genetisch(?:e|er|es)?|biometrisch(?:e|er|es)?|Fingerabdruck|Gesichtserkennung)\b', re.IGNORECASE),
-        'art9_religion': re.compile(r'\b(?:katholisch|evangelisch|muslim(?:isch)?|j\u00fcdisch|buddhist(?:isch)?|hindu(?:istisch)?|atheist(?:isch)?)\b', re.IGNORECASE),
-        'art9_politics': re.compile(r'\b(?:CDU|CSU|SPD|FDP|AfD|Die\s+Linke|GR\u00dcNE|Gr\u00fcne)\b', re.IGNORECASE),
-        'art9_union': re.compile(r'\b(?:Gewerkschaft|ver\.di|IG\s+Metall|IG\s+BCE)\b', re.IGNORECASE),
-        'art9_sexuality': re.compile(r'\b(?:sexuelle\s+Orientierung|homosexuell|heterosexuell|bisexuell|transgender|queer)\b', re.IGNORECASE),
-    }
+    """
+    
+    PATTERNS = PATTERNS
+    COMBINED_PATTERN = COMBINED_PATTERN
     
     def __init__(self):
         """Initialize the service with in-memory storage."""
         # Session storage - cleared after each request
         self.current_mappings: Dict[str, str] = {}
         self.used_placeholders: Set[str] = set()
-        self.session_salt = secrets.token_hex(16)
+        self.session_salt = _new_session_salt()
         self._anonymization_stats = {'total_phi_elements': 0, 'by_category': {}}
 
-        self.fail_on_missing_placeholders = os.getenv(
-            "REIDENTIFY_FAIL_ON_MISSING_PLACEHOLDERS", "false"
-        ).strip().lower() in {"1", "true", "yes", "on"}
-    
-    def _generate_placeholder(self, original: str, category: str) -> str:
-        """
-        Generate a collision-resistant placeholder.
-        
-        Args:
-            original: Original PHI value
-            category: Type of PHI (name, date, id, etc.)
-        
-        Returns:
-            Unique placeholder string
-        """
-        # Create a hash of the original value with session salt for uniqueness
-        hash_input = f"{self.session_salt}:{original}:{category}".encode('utf-8')
-        hash_digest = hashlib.sha256(hash_input).hexdigest()[:8]
-        
-        # Generate placeholder with category prefix
-        base_placeholder = f"[{category.upper()}_{hash_digest}]"
-        
-        # Ensure uniqueness
-        placeholder = base_placeholder
-        counter = 1
-        while placeholder in self.used_placeholders:
-            placeholder = f"[{category.upper()}_{hash_digest}_{counter}]"
-            counter += 1
-        
-        self.used_placeholders.add(placeholder)
-        return placeholder
+        self.fail_on_missing_placeholders = _fail_on_missing_from_env()
     
     def anonymize(self, text: str) -> Tuple[str, Dict[str, str]]:
-        """
-        Anonymize PHI in text using pattern-based detection with position tracking.
-        
-        Uses position-based replacement to correctly handle duplicate text.
-        Processes all patterns in a single pass, then applies replacements from end to start.
-        
-        Args:
-            text: Original text containing PHI
-        
-        Returns:
-            Tuple of (anonymized_text, mappings_dict)
-        """
-        # Reset session storage
-        self.current_mappings = {}
-        self.used_placeholders = set()
-        self.session_salt = secrets.token_hex(16)
-        self._anonymization_stats = {'total_phi_elements': 0, 'by_category': {}}
-        
-        # Collect all matches with position information
-        all_matches: List[Match] = []
-        
-        # Process each pattern type
-        for category, pattern in self.PATTERNS.items():
-            for regex_match in pattern.finditer(text):
-                original = regex_match.group(0)
-                start = regex_match.start()
-                end = regex_match.end()
-                
-                # Generate placeholder
-                placeholder = self._generate_placeholder(original, category)
-                self.current_mappings[placeholder] = original
-                
-                # Track the match with position
-                all_matches.append(Match(
-                    start=start,
-                    end=end,
-                    original=original,
-                    placeholder=placeholder,
-                    category=category
-                ))
-                
-                # Update statistics
-                self._anonymization_stats['by_category'][category] = \
-                    self._anonymization_stats['by_category'].get(category, 0) + 1
-        
-        # Sort matches by start position (descending) to replace from end to start
-        # This prevents position shifts from affecting subsequent replacements
-        all_matches.sort(key=lambda m: m.start, reverse=True)
-        
-        # Apply replacements from end to start
-        anonymized_text = text
-        for match in all_matches:
-            anonymized_text = (
-                anonymized_text[:match.start] + 
-                match.placeholder + 
-                anonymized_text[match.end:]
-            )
-        
-        self._anonymization_stats['total_phi_elements'] = len(all_matches)
-        
-        logger.info(
-            "Anonymized text: %d unique elements (categories=%s)",
-            len(self.current_mappings),
-            list(self._anonymization_stats['by_category'].keys()),
+        """Anonymize `text` (see module-level `anonymize`) and keep the session state."""
+        self.session_salt = _new_session_salt()
+        anonymized_text, self.current_mappings, self._anonymization_stats = _anonymize(
+            text, self.session_salt
         )
+        self.used_placeholders = set(self.current_mappings)
         return anonymized_text, self.current_mappings
     
     def reidentify(self, text: str, mappings: Dict[str, str]) -> str:
-        """
-        Re-identify anonymized text using provided mappings.
-        
-        Validates that all expected placeholders are present and warns if any are missing.
-        This helps detect if the LLM modified or removed placeholders.
-        
-        Args:
-            text: Anonymized text with placeholders
-            mappings: Dictionary mapping placeholders to original values
-        
-        Returns:
-            Original text with PHI restored
-        """
-        reidentified_text = text
-        
-        # Validate placeholder presence
-        missing_placeholders = []
-        for placeholder in mappings.keys():
-            if placeholder not in text:
-                missing_placeholders.append(placeholder)
-        
-        if missing_placeholders:
-            logger.warning(
-                f"Re-identification warning: {len(missing_placeholders)} placeholder(s) "
-                f"not found in LLM response. They may have been modified or removed. "
-                f"First missing: {missing_placeholders[0]}"
-            )
-
-            if self.fail_on_missing_placeholders:
-                raise ValueError("Missing placeholders in downstream response")
-        
-        # Sort by placeholder length (descending) to avoid partial replacements
-        sorted_mappings = sorted(mappings.items(), key=lambda x: len(x[0]), reverse=True)
-        
-        for placeholder, original in sorted_mappings:
-            reidentified_text = reidentified_text.replace(placeholder, original)
-        
-        logger.info(
-            "Re-identified text using %d mappings (missing=%d)",
-            len(mappings),
-            len(missing_placeholders),
-        )
-        return reidentified_text
+        """Re-identify `text` (see module-level `reidentify`)."""
+        return reidentify(text, mappings, fail_on_missing=self.fail_on_missing_placeholders)
     
     def get_stats(self) -> Dict:
         """Return anonymization statistics for observability."""
@@ -232,4 +551,4 @@ class AnonymizationService:
         """Clear all session data (called after each request)."""
         self.current_mappings.clear()
         self.used_placeholders.clear()
-        self.session_salt = secrets.token_hex(16)
+        self.session_salt = _new_session_salt()
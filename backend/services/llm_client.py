@@ -6,11 +6,16 @@ Improvements:
 - Enhanced error handling with specific HTTP status codes
 - Configurable timeout and retry parameters
 - Better logging for observability
+- One pooled HTTP/2 client per LLMClient
+- orjson for request/response bodies
 """
 import httpx
 import logging
+import orjson
 import asyncio
-from typing import Dict, Optional
+import random
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from enum import Enum
 from pathlib import Path
@@ -31,8 +36,12 @@ class LLMSettings(BaseSettings):
     llm_api_key: str = ""
     llm_model: str = "gpt-4"
     llm_timeout: int = 60
+    llm_connect_timeout: float = 5.0
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
     llm_max_retries: int = 3
     llm_retry_delay: float = 1.0  # Initial delay in seconds
+    llm_retry_max: float = 30.0  # Upper bound for a single backoff delay
     llm_provider: LLMProvider = LLMProvider.OPENAI
 
     # Optional: path to a master system prompt file (repo-local)
@@ -42,6 +51,50 @@ class LLMSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
+# Parsed once at import (env + .env); runtime env changes are not supported
+SETTINGS = LLMSettings()
+
+
+class CircuitBreaker:
+    """
+    Process-wide circuit breaker with a cooldown and half-open probing.
+
+    Opens after `threshold` consecutive failures. Once `cooldown` seconds
+    have passed, one caller is let through as a probe: success closes the
+    breaker, failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        """Return True if a call may go out now."""
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        # Half-open: let this caller probe; others wait for the next cooldown
+        self.opened_at = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+# Shared by all LLMClient instances so every caller sees the same outage state
+circuit_breaker = CircuitBreaker()
+
+
 class LLMClient:
     """
     Client for external LLM API calls with retry logic and enhanced error handling.
@@ -54,10 +107,24 @@ class LLMClient:
     
     def __init__(self):
         """Initialize LLM client with environment configuration."""
-        self.settings = LLMSettings()
-        self.client = httpx.AsyncClient(timeout=self.settings.llm_timeout)
-        self._circuit_breaker_failures = 0
-        self._circuit_breaker_threshold = 5
+        self.settings = SETTINGS
+        # Long-lived and pooled: the app shares one instance and closes it in the lifespan
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(
+                self.settings.llm_timeout, connect=self.settings.llm_connect_timeout
+            ),
+            limits=httpx.Limits(
+                max_connections=self.settings.llm_max_connections,
+                max_keepalive_connections=self.settings.llm_max_keepalive_connections,
+            ),
+        )
+        self._circuit_breaker = circuit_breaker
+        # Request headers never change at runtime
+        self._headers = {
+            "Authorization": f"Bearer {self.settings.llm_api_key}",
+            "Content-Type": "application/json"
+        }
         self._cached_master_prompt: Optional[str] = None
     
     async def generate(self, prompt: str, task: str) -> str:
@@ -81,9 +148,9 @@ class LLMClient:
             return self._generate_mock_response(prompt, task)
         
         # Check circuit breaker
-        if self._circuit_breaker_failures >= self._circuit_breaker_threshold:
+        if not self._circuit_breaker.allow():
             logger.error(
-                f"Circuit breaker open: {self._circuit_breaker_failures} consecutive failures. "
+                f"Circuit breaker open: {self._circuit_breaker.failures} consecutive failures. "
                 "Returning mock response."
             )
             return self._generate_mock_response(prompt, task)
@@ -94,8 +161,8 @@ class LLMClient:
             try:
                 response = await self._make_request(prompt, task)
                 
-                # Reset circuit breaker on success
-                self._circuit_breaker_failures = 0
+                # Close the circuit breaker on success
+                self._circuit_breaker.record_success()
                 return response
                 
             except httpx.HTTPStatusError as e:
@@ -107,15 +174,15 @@ class LLMClient:
                     logger.error(
                         f"Non-retryable LLM API error: {status_code}."
                     )
-                    self._circuit_breaker_failures += 1
+                    self._circuit_breaker.record_failure()
                     raise Exception(f"LLM API error: {status_code}")
                 
                 # Retryable error - calculate backoff
                 if attempt < self.settings.llm_max_retries - 1:
-                    delay = self.settings.llm_retry_delay * (2 ** attempt)
+                    delay = self._backoff_delay(attempt)
                     logger.warning(
                         f"LLM API error {status_code} (attempt {attempt + 1}/"
-                        f"{self.settings.llm_max_retries}). Retrying in {delay}s..."
+                        f"{self.settings.llm_max_retries}). Retrying in {delay:.2f}s..."
                     )
                     await asyncio.sleep(delay)
                 else:
@@ -123,37 +190,93 @@ class LLMClient:
                         f"LLM API error {status_code}. All {self.settings.llm_max_retries} "
                         "retries exhausted."
                     )
-                    self._circuit_breaker_failures += 1
+                    self._circuit_breaker.record_failure()
                     
             except httpx.TimeoutException as e:
                 last_exception = e
                 if attempt < self.settings.llm_max_retries - 1:
-                    delay = self.settings.llm_retry_delay * (2 ** attempt)
+                    delay = self._backoff_delay(attempt)
                     logger.warning(
                         f"LLM API timeout (attempt {attempt + 1}/"
-                        f"{self.settings.llm_max_retries}). Retrying in {delay}s..."
+                        f"{self.settings.llm_max_retries}). Retrying in {delay:.2f}s..."
                     )
                     await asyncio.sleep(delay)
                 else:
                     logger.error("LLM API timeout. All retries exhausted.")
-                    self._circuit_breaker_failures += 1
+                    self._circuit_breaker.record_failure()
                     
             except Exception as e:
                 last_exception = e
                 # Do not log exception message content (may contain personal data)
                 logger.error(f"Unexpected LLM API error: {type(e).__name__}")
-                self._circuit_breaker_failures += 1
+                self._circuit_breaker.record_failure()
                 break  # Don't retry unexpected errors
         
         # All retries exhausted
         raise Exception(f"LLM API call failed after {self.settings.llm_max_retries} attempts: {str(last_exception)}")
     
-    async def _make_request(self, prompt: str, task: str) -> str:
+    async def generate_stream(self, prompt: str, task: str) -> AsyncIterator[str]:
         """
-        Make the actual HTTP request to the LLM API.
+        Stream the LLM response as text deltas (server-sent events).
         
-        Separated for cleaner retry logic.
+        No retries: a stream cannot be replayed once chunks were handed out.
+        Uses the same circuit breaker and mock fallback as `generate`.
+        """
+        if not self.settings.llm_api_key:
+            logger.warning("LLM API key not configured, returning mock response")
+            yield self._generate_mock_response(prompt, task)
+            return
+        
+        if not self._circuit_breaker.allow():
+            logger.error(
+                f"Circuit breaker open: {self._circuit_breaker.failures} consecutive failures. "
+                "Returning mock response."
+            )
+            yield self._generate_mock_response(prompt, task)
+            return
+        
+        payload, headers = self._build_request(prompt, task)
+        payload["stream"] = True
+        logger.info(
+            f"Streaming LLM API: {self.settings.llm_api_url} "
+            f"(model: {self.settings.llm_model}, prompt_length: {len(prompt)})"
+        )
+        
+        try:
+            async with self.client.stream(
+                "POST", self.settings.llm_api_url, content=orjson.dumps(payload), headers=headers
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    event = orjson.loads(data)
+                    choices = event.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except Exception as e:
+            # Do not log exception message content (may contain personal data)
+            logger.error(f"LLM streaming error: {type(e).__name__}")
+            self._circuit_breaker.record_failure()
+            raise
+        
+        self._circuit_breaker.record_success()
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter, capped at llm_retry_max.
+
+        The random spread keeps concurrent requests that failed together
+        (e.g. on a 429) from retrying in lockstep.
         """
+        base = self.settings.llm_retry_delay
+        return min(self.settings.llm_retry_max, random.uniform(base, base * 3 * (2 ** attempt)))
+    
+    def _build_request(self, prompt: str, task: str) -> Tuple[Dict, Dict[str, str]]:
+        """Build the provider payload and headers for one completion request."""
         # Prepare request based on provider
         if self.settings.llm_provider == LLMProvider.OPENAI:
             system_prompt = self._build_system_prompt(task)
@@ -173,26 +296,33 @@ class LLMClient:
                 "max_tokens": 2000
             }
             
-            headers = {
-                "Authorization": f"Bearer {self.settings.llm_api_key}",
-                "Content-Type": "application/json"
-            }
+            headers = self._headers
         else:
             raise ValueError(f"Unsupported LLM provider: {self.settings.llm_provider}")
+        return payload, headers
+    
+    async def _make_request(self, prompt: str, task: str) -> str:
+        """
+        Make the actual HTTP request to the LLM API.
+        
+        Separated for cleaner retry logic.
+        """
+        payload, headers = self._build_request(prompt, task)
         
         logger.info(
             f"Calling LLM API: {self.settings.llm_api_url} "
             f"(model: {self.settings.llm_model}, prompt_length: {len(prompt)})"
         )
         
+        # Content-Type comes from the per-request headers (self._headers)
         response = await self.client.post(
             self.settings.llm_api_url,
-            json=payload,
+            content=orjson.dumps(payload),
             headers=headers
         )
         response.raise_for_status()
         
-        result = response.json()
+        result = orjson.loads(response.content)
         generated_text = result["choices"][0]["message"]["content"]
         
         logger.info(
@@ -0,0 +1,15 @@
+"""
+Small shared helpers for the backend.
+"""
+import os
+
+# Values treated as "enabled"; anything else (when set) is "disabled"
+_TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean env var; `default` applies only when it is unset."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in _TRUE_VALUES
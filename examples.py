@@ -3,13 +3,58 @@
 Comprehensive example demonstrating SecureDoc Flow usage.
 """
 
-import requests
-import json
+import asyncio
+import functools
+import httpx
+import orjson
 from datetime import datetime
 
+from backend.utils import env_bool
+
 BASE_URL = "http://localhost:8000"
 MCP_URL = "http://localhost:3000"
 
+# One pooled client per service: keep-alive reuses connections across requests
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=8, max_connections=16)
+
+# Wall-clock cap for the service preflight, however many endpoints it probes
+PREFLIGHT_TIMEOUT = 2.0
+
+# EXAMPLES_OFFLINE=1 skips the preflight (dry runs, CI, services known to be up)
+SKIP_PREFLIGHT = env_bool("EXAMPLES_OFFLINE")
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def encode_json(data) -> bytes:
+    """Serialize a request body."""
+    return orjson.dumps(data)
+
+
+def decode_json(response: httpx.Response):
+    """Parse a response body."""
+    return orjson.loads(response.content)
+
+
+@functools.lru_cache(maxsize=32)
+def generate_body(practice_id: str, task: str, text: str) -> bytes:
+    """Encoded /v1/securedoc/generate body; repeated payloads are encoded once."""
+    return encode_json({"practice_id": practice_id, "task": task, "text": text})
+
+
+def post_generate(client: httpx.AsyncClient, practice_id: str, task: str, text: str):
+    """POST a SecureDoc generate request (returns the awaitable response)."""
+    return client.post(
+        "/v1/securedoc/generate",
+        content=generate_body(practice_id, task, text),
+        headers=JSON_HEADERS,
+    )
+
+
+# Size-limit probes (the backend accepts up to 50000 characters)
+MAX_TEXT = "a" * 50000
+OVERSIZE_TEXT = MAX_TEXT + "a"
+
 
 def print_section(title):
     """Print a section header."""
@@ -18,7 +63,7 @@ def print_section(title):
     print("=" * 80)
 
 
-def example_securedoc_basic():
+async def example_securedoc_basic(client):
     """Example 1: Basic SecureDoc usage with PHI."""
     print_section("Example 1: Basic SecureDoc Document Generation")
     
@@ -45,13 +90,10 @@ def example_securedoc_basic():
     print(f"Practice ID: {request_data['practice_id']}")
     print(f"Task: {request_data['task']}")
     
-    response = requests.post(
-        f"{BASE_URL}/v1/securedoc/generate",
-        json=request_data
-    )
+    response = await post_generate(client, **request_data)
     
     if response.status_code == 200:
-        result = response.json()
+        result = decode_json(response)
         print("\n✓ Success!")
         print("\nGenerated Output:")
         print("-" * 80)
@@ -59,10 +101,10 @@ def example_securedoc_basic():
         print("-" * 80)
     else:
         print(f"\n✗ Error: {response.status_code}")
-        print(response.json())
+        print(response.text)
 
 
-def example_securedoc_extraction():
+async def example_securedoc_extraction(client):
     """Example 2: Data extraction task."""
     print_section("Example 2: Data Extraction from Clinical Note")
     
@@ -93,13 +135,10 @@ def example_securedoc_extraction():
     }
     
     print("\nSending extraction request...")
-    response = requests.post(
-        f"{BASE_URL}/v1/securedoc/generate",
-        json=request_data
-    )
+    response = await post_generate(client, **request_data)
     
     if response.status_code == 200:
-        result = response.json()
+        result = decode_json(response)
         print("\n✓ Success!")
         print("\nExtracted Information:")
         print("-" * 80)
@@ -108,52 +147,49 @@ def example_securedoc_extraction():
         print(f"\n✗ Error: {response.status_code}")
 
 
-def example_validation_errors():
+async def example_validation_errors(client):
     """Example 3: Input validation."""
     print_section("Example 3: Input Validation Examples")
     
+    # The three probes are independent: send them concurrently
+    empty_practice, too_long, max_size = await asyncio.gather(
+        post_generate(client, "", "test", "Some text"),
+        post_generate(client, "test", "test", OVERSIZE_TEXT),
+        post_generate(client, "test", "test", MAX_TEXT),
+    )
+    
     # Test 1: Empty practice_id
     print("\nTest 1: Empty practice_id (should fail)")
-    response = requests.post(
-        f"{BASE_URL}/v1/securedoc/generate",
-        json={"practice_id": "", "task": "test", "text": "Some text"}
-    )
-    print(f"Status: {response.status_code}")
-    if response.status_code != 200:
+    print(f"Status: {empty_practice.status_code}")
+    if empty_practice.status_code != 200:
         print("✓ Correctly rejected")
     
     # Test 2: Text too long
     print("\nTest 2: Text exceeding size limit (should fail)")
-    long_text = "a" * 50001
-    response = requests.post(
-        f"{BASE_URL}/v1/securedoc/generate",
-        json={"practice_id": "test", "task": "test", "text": long_text}
-    )
-    print(f"Status: {response.status_code}")
-    if response.status_code != 200:
+    print(f"Status: {too_long.status_code}")
+    if too_long.status_code != 200:
         print("✓ Correctly rejected")
     
     # Test 3: Valid at max size
     print("\nTest 3: Text at max size (50000 chars, should succeed)")
-    max_text = "a" * 50000
-    response = requests.post(
-        f"{BASE_URL}/v1/securedoc/generate",
-        json={"practice_id": "test", "task": "test", "text": max_text}
-    )
-    print(f"Status: {response.status_code}")
-    if response.status_code == 200:
+    print(f"Status: {max_size.status_code}")
+    if max_size.status_code == 200:
         print("✓ Correctly accepted")
 
 
-def example_mcp_server():
+async def example_mcp_server(mcp_client):
     """Example 4: MCP Server usage."""
     print_section("Example 4: MCP Tool Server - Get Free Slots")
     
-    print("\nFetching free slots for today...")
-    response = requests.get(f"{MCP_URL}/tools/get_free_slots")
+    # Both slot queries are independent: send them concurrently
+    response, dated_response = await asyncio.gather(
+        mcp_client.get("/tools/get_free_slots"),
+        mcp_client.get("/tools/get_free_slots", params={"date": "2025-12-26"}),
+    )
     
+    print("\nFetching free slots for today...")
     if response.status_code == 200:
-        result = response.json()
+        result = decode_json(response)
         print(f"\n✓ Success! Date: {result['date']}")
         print("\nAvailable Appointment Slots:")
         print("-" * 80)
@@ -163,34 +199,29 @@ def example_mcp_server():
         print(f"\n✗ Error: {response.status_code}")
     
     print("\n\nFetching free slots for specific date...")
-    response = requests.get(
-        f"{MCP_URL}/tools/get_free_slots",
-        params={"date": "2025-12-26"}
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
+    if dated_response.status_code == 200:
+        result = decode_json(dated_response)
         print(f"✓ Success! Date: {result['date']}")
         print(f"Number of slots: {len(result['slots'])}")
 
 
-def example_health_checks():
+async def example_health_checks(client, mcp_client):
     """Example 5: Health checks."""
     print_section("Example 5: Service Health Checks")
     
     print("\nChecking Backend Health...")
-    response = requests.get(f"{BASE_URL}/health")
+    response = await client.get("/health")
     if response.status_code == 200:
-        print(f"✓ Backend: {response.json()['status']}")
+        print(f"✓ Backend: {decode_json(response)['status']}")
     
     print("\nChecking MCP Server Health...")
-    response = requests.get(f"{MCP_URL}/health")
+    response = await mcp_client.get("/health")
     if response.status_code == 200:
-        data = response.json()
+        data = decode_json(response)
         print(f"✓ MCP Server: {data['status']} - {data['service']}")
 
 
-def main():
+async def main():
     """Run all examples."""
     print("\n" + "=" * 80)
     print("SECUREDOC FLOW - COMPREHENSIVE EXAMPLES")
@@ -200,23 +231,31 @@ def main():
     print("  MCP Server: http://localhost:3000")
     print()
     
-    try:
-        # Check services are running
-        requests.get(f"{BASE_URL}/health", timeout=2)
-        requests.get(f"{MCP_URL}/health", timeout=2)
-    except requests.exceptions.RequestException as e:
-        print("✗ Error: Services are not running!")
-        print("\nPlease start the services:")
-        print("  Terminal 1: uvicorn backend.main:app --host 0.0.0.0 --port 8000")
-        print("  Terminal 2: npm start")
-        return
-    
-    # Run examples
-    example_health_checks()
-    example_securedoc_basic()
-    example_securedoc_extraction()
-    example_validation_errors()
-    example_mcp_server()
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, timeout=10, limits=CLIENT_LIMITS, http2=True
+    ) as client, httpx.AsyncClient(
+        base_url=MCP_URL, timeout=10, limits=CLIENT_LIMITS, http2=True
+    ) as mcp_client:
+        if not SKIP_PREFLIGHT:
+            try:
+                # Check services are running; both probes share one 2s budget
+                await asyncio.wait_for(
+                    asyncio.gather(client.get("/health"), mcp_client.get("/health")),
+                    timeout=PREFLIGHT_TIMEOUT,
+                )
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                print("✗ Error: Services are not running!")
+                print("\nPlease start the services:")
+                print("  Terminal 1: uvicorn backend.main:app --host 0.0.0.0 --port 8000")
+                print("  Terminal 2: npm start")
+                return
+        
+        # Run examples
+        await example_health_checks(client, mcp_client)
+        await example_securedoc_basic(client)
+        await example_securedoc_extraction(client)
+        await example_validation_errors(client)
+        await example_mcp_server(mcp_client)
     
     print("\n" + "=" * 80)
     print("ALL EXAMPLES COMPLETED")
@@ -225,4 +264,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,4 +1,40 @@
+import httpx
 import pytest
+import pytest_asyncio
+from fastapi.testclient import TestClient
+
+import backend.routers.billing as billing_router
+import backend.routers.securedoc as securedoc_router
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient for the whole session; the app lifespan runs once."""
+    from backend.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest_asyncio.fixture
+async def aclient():
+    """In-process async client, so a test can fan requests out concurrently.
+
+    ASGITransport does not run the lifespan; the SecureDoc routes do not need it.
+    """
+    from backend.main import app
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as async_client:
+        yield async_client
+
+
+def _clear_global_states():
+    """Empty the in-memory request state; most tests never touch it."""
+    for state in (securedoc_router._rate_state, billing_router.processed_events):
+        if state:
+            state.clear()
 
 
 @pytest.fixture(autouse=True)
@@ -7,28 +43,17 @@ def _reset_global_states(monkeypatch):
 
     - Clears SecureDoc rate-limit bucket state between tests
     - Clears Stripe webhook idempotency cache between tests
-    - Mocks LLM calls so tests never depend on network or API keys
+    - Mocks LLM calls (plain and streaming) so tests never depend on network or API keys
     """
-    # Import inside fixture to avoid import-order surprises.
-    import backend.routers.securedoc as securedoc_router
-    import backend.routers.billing as billing_router
-
     # --- SecureDoc defaults (safe + stable for tests) ---
-    # Use os.environ directly here (instead of monkeypatch.setenv) to avoid
-    # edge cases with TestClient thread/context seeing an empty value.
-    import os
-    prev = {
-        "SECUREDOC_REQUIRE_API_KEY": os.environ.get("SECUREDOC_REQUIRE_API_KEY"),
-        "SECUREDOC_API_KEY": os.environ.get("SECUREDOC_API_KEY"),
-        "SECUREDOC_RATE_LIMIT_ENABLED": os.environ.get("SECUREDOC_RATE_LIMIT_ENABLED"),
-    }
-    os.environ["SECUREDOC_REQUIRE_API_KEY"] = "true"
-    os.environ["SECUREDOC_API_KEY"] = "test-api-key"
-    os.environ["SECUREDOC_RATE_LIMIT_ENABLED"] = "false"
+    # SecureDoc parses its env once, so the reload (not the env) is what requests see.
+    monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
+    monkeypatch.setenv("SECUREDOC_API_KEY", "test-api-key")
+    monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "false")
+    securedoc_router._reload_config()
 
     # --- Reset global in-memory states ---
-    securedoc_router._rate_state.clear()
-    billing_router.processed_events.clear()
+    _clear_global_states()
 
     # --- Mock LLM to avoid any external dependency ---
     async def _mock_generate(prompt: str, task: str) -> str:
@@ -37,15 +62,14 @@ def _reset_global_states(monkeypatch):
 
     monkeypatch.setattr(securedoc_router.llm_client, "generate", _mock_generate, raising=True)
 
+    async def _mock_generate_stream(prompt: str, task: str):
+        # Echo the prompt in small chunks so placeholders get split across chunks.
+        for i in range(0, len(prompt), 7):
+            yield prompt[i:i + 7]
+
+    monkeypatch.setattr(securedoc_router.llm_client, "generate_stream", _mock_generate_stream, raising=True)
+
     yield
 
     # Best-effort cleanup again.
-    securedoc_router._rate_state.clear()
-    billing_router.processed_events.clear()
-
-    # Restore env
-    for key, value in prev.items():
-        if value is None:
-            os.environ.pop(key, None)
-        else:
-            os.environ[key] = value
+    _clear_global_states()
@@ -3,41 +3,72 @@ Comprehensive tests for SecureDoc Flow Backend.
 Run with: python3 -m pytest tests/test_backend.py -v
 """
 
-import sys
-import os
+import pytest
+from backend.services.anonymization import AnonymizationService, anonymize, reidentify
 
-# Add project root to path for imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Static request inputs, built once
+_HEADERS = {"X-API-Key": "test-api-key"}
+_MAX_TEXT = "a" * 50000
+_OVER_TEXT = _MAX_TEXT + "a"
 
-import pytest
-from fastapi.testclient import TestClient
-from backend.main import app
-from backend.services.anonymization import AnonymizationService
+# Stripe webhook fixtures; construct_event is stubbed, so the payload is opaque
+_WEBHOOK_NOW = 1_700_000_000
+_WEBHOOK_EVENT = {
+    "id": "evt_test_1",
+    "type": "checkout.session.completed",
+    "created": _WEBHOOK_NOW,
+    "data": {"object": {"id": "cs_test_1"}},
+}
+_WEBHOOK_PAYLOAD = b'{"any": "payload"}'
+_WEBHOOK_HEADERS = {"Stripe-Signature": "t=123,v1=fake", "Content-Type": "application/json"}
 
-client = TestClient(app)
+
+def _fake_construct_event(payload, sig_header, secret):
+    return _WEBHOOK_EVENT
 
 
 class TestHealthEndpoints:
     """Test health and root endpoints."""
     
-    def test_root(self):
+    def test_root(self, client):
         response = client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert data["service"] == "SecureDoc Flow Privacy Proxy"
         assert data["status"] == "operational"
     
-    def test_health(self):
+    def test_health(self, client):
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
 
+class TestUiEndpoints:
+    """Test static demo UI endpoints."""
+
+    def test_ui_served_with_etag(self, client):
+        response = client.get("/ui/version1")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/html")
+        assert response.headers["etag"]
+
+    def test_ui_conditional_get_not_modified(self, client):
+        etag = client.get("/ui/presentation").headers["etag"]
+        response = client.get("/ui/presentation", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+
 class TestAnonymizationService:
     """Test PHI anonymization service."""
-    
-    def test_date_anonymization(self):
+
+    @pytest.fixture
+    def service(self):
         service = AnonymizationService()
+        yield service
+        service.clear_session()
+    
+    def test_date_anonymization(self, service):
         text = "Patient DOB: 01/15/1980, appointment on 2024-03-20, Folgetermin: 31.12.2025, Bericht: 3. März 2026"
         anonymized, mappings = service.anonymize(text)
         
@@ -47,47 +78,136 @@ class TestAnonymizationService:
         assert "3. März 2026" not in anonymized
         assert len([k for k in mappings.keys() if "DATE" in k]) == 4
     
-    def test_email_anonymization(self):
-        service = AnonymizationService()
+    def test_email_anonymization(self, service):
         text = "Contact: john.doe@example.com"
         anonymized, mappings = service.anonymize(text)
         
         assert "john.doe@example.com" not in anonymized
         assert len([k for k in mappings.keys() if "EMAIL" in k]) == 1
     
-    def test_phone_anonymization(self):
-        service = AnonymizationService()
+    def test_phone_anonymization(self, service):
         text = "Phone: (555) 123-4567 or 555-987-6543"
         anonymized, mappings = service.anonymize(text)
         
         assert len([k for k in mappings.keys() if "PHONE" in k]) >= 2
     
-    def test_id_anonymization(self):
-        service = AnonymizationService()
+    def test_id_anonymization(self, service):
         text = "MRN: 12345678"
         anonymized, mappings = service.anonymize(text)
         
         assert "MRN: 12345678" not in anonymized
         assert len([k for k in mappings.keys() if "ID" in k]) == 1
     
-    def test_name_anonymization(self):
-        service = AnonymizationService()
+    def test_name_anonymization(self, service):
         text = "Dr. Jane Smith"
         anonymized, mappings = service.anonymize(text)
         
         assert "Dr. Jane Smith" not in anonymized
         assert len([k for k in mappings.keys() if "NAME" in k]) == 1
     
-    def test_reidentification(self):
-        service = AnonymizationService()
+    def test_reidentification(self, service):
         original = "Patient DOB: 01/15/1980"
         anonymized, mappings = service.anonymize(original)
         reidentified = service.reidentify(anonymized, mappings)
         
         assert "01/15/1980" in reidentified
 
-    def test_art9_icd10_anonymization(self):
-        service = AnonymizationService()
+    def test_reidentify_does_not_rescan_restored_values(self, service):
+        mappings = {"[NAME_aaaaaaaa]": "[DATE_bbbbbbbb]", "[DATE_bbbbbbbb]": "01/15/1980"}
+
+        assert service.reidentify("x [NAME_aaaaaaaa] y", mappings) == "x [DATE_bbbbbbbb] y"
+
+    def test_reidentify_non_standard_placeholders(self):
+        mappings = {"<<patient>>": "Jane Smith", "[DATE_abcdef12]": "01/15/1980"}
+        text = "<<patient>> born [DATE_abcdef12], see [DATE_00000000]"
+        expected = "Jane Smith born 01/15/1980, see [DATE_00000000]"
+
+        assert reidentify(text, mappings) == expected
+
+    def test_streaming_reidentify_handles_split_placeholders(self):
+        from backend.services.anonymization import StreamingReidentifier
+
+        original = "Dr. Jane Smith saw MRN: 12345678 on 01/15/1980, mail john@example.com"
+        anonymized, mappings = anonymize(original)
+
+        for size in (1, 3, 8, len(anonymized)):
+            reidentifier = StreamingReidentifier(dict(mappings), fail_on_missing=True)
+            chunks = [anonymized[i:i + size] for i in range(0, len(anonymized), size)]
+            out = "".join(reidentifier.feed(c) for c in chunks) + reidentifier.finish()
+            assert out == original
+
+        reidentifier = StreamingReidentifier(dict(mappings), fail_on_missing=True)
+        reidentifier.feed("placeholders dropped")
+        with pytest.raises(ValueError):
+            reidentifier.finish()
+
+    def test_multiple_matches_preserve_surrounding_text(self, service):
+        original = "A john.doe@example.com B 01/15/1980 C john.doe@example.com D"
+        anonymized, mappings = service.anonymize(original)
+
+        assert anonymized.startswith("A [EMAIL_")
+        assert anonymized.endswith("] D")
+        assert " B [DATE_" in anonymized
+        assert service.reidentify(anonymized, mappings) == original
+
+    def test_repeated_value_reuses_placeholder(self, service):
+        anonymized, mappings = service.anonymize("MRN: 12345678 ... MRN: 12345678")
+
+        assert len(mappings) == 1
+        placeholder = next(iter(mappings))
+        assert anonymized == f"{placeholder} ... {placeholder}"
+        assert service.get_stats()['total_phi_elements'] == 2
+
+    def test_id_with_non_ascii_word_characters(self):
+        # \w and \d must stay Unicode-aware (stdlib re), or these IDs leak
+        for text in ("MRN: Müller12345", "ID: Jürgen98765", "MRN: ١٢٣٤٥٦٧٨٩"):
+            anonymized, mappings = anonymize(text)
+            assert anonymized.startswith("[ID_"), text
+            assert list(mappings.values()) == [text]
+
+    def test_prescan_skips_non_keyword_categories_safely(self):
+        from backend.services import anonymization
+
+        texts = [
+            "Patient ist katholisch und Mitglied der SPD, DNA-Test geplant.",
+            "No identifiers here at all.",
+            "Dr. Jane Smith",
+        ]
+        for text in texts:
+            expected = [(m.lastgroup, m.span()) for m in anonymization.COMBINED_PATTERN.finditer(text)]
+            anonymized, mappings = anonymize(text)
+            assert len(mappings) == len({text[a:b] for _, (a, b) in expected})
+            assert reidentify(anonymized, mappings) == text
+
+        assert anonymize("No identifiers here at all.") == ("No identifiers here at all.", {})
+
+    def test_email_pattern_is_not_quadratic(self):
+        import time
+
+        # Max-size texts of short runs; retrying every start position took seconds here
+        for text in ("a." * 25_000, "a." * 24_990 + "@x.com", "a@" * 25_000):
+            start = time.perf_counter()
+            anonymize(text)
+            assert time.perf_counter() - start < 1.0
+
+    def test_email_with_long_local_part_is_replaced(self):
+        for address in ("a" * 70 + "@example.com", "x_y_" * 30 + "@clinic.de"):
+            anonymized, mappings = anonymize(f"Contact {address} today")
+
+            assert anonymized.startswith("Contact [EMAIL_")
+            assert anonymized.endswith("] today")
+            assert list(mappings.values()) == [address]
+
+    def test_art9_patterns_can_be_disabled(self):
+        from backend.services import anonymization
+
+        assert set(anonymization._build_patterns(include_art9=True)) >= set(anonymization.ART9_PATTERNS)
+        base_only = anonymization._build_patterns(include_art9=False)
+        assert not any(category.startswith("art9_") for category in base_only)
+        combined = anonymization._combine_patterns(base_only)
+        assert combined.search("katholisch, E11.9") is None
+
+    def test_art9_icd10_anonymization(self, service):
         text = "Diagnose: E11.9 (Diabetes mellitus Typ 2)"
         anonymized, mappings = service.anonymize(text)
 
@@ -117,8 +237,18 @@ class TestAnonymizationService:
         assert len(map1) > 0 and len(map2) > 0
         assert list(map1.keys())[0] != list(map2.keys())[0]
     
-    def test_session_clearing(self):
-        service = AnonymizationService()
+    def test_module_functions_are_stateless(self):
+        original = "Contact: john.doe@example.com"
+        anon1, map1 = anonymize(original)
+        anon2, map2 = anonymize(original)
+
+        assert map1 is not map2
+        assert anon1 != anon2
+        assert reidentify(anon1, map1) == original
+        with pytest.raises(ValueError):
+            reidentify("no placeholders", map1, fail_on_missing=True)
+
+    def test_session_clearing(self, service):
         service.anonymize("test@example.com")
         
         assert len(service.current_mappings) > 0
@@ -127,89 +257,138 @@ class TestAnonymizationService:
         assert len(service.used_placeholders) == 0
 
 
+@pytest.mark.asyncio
 class TestSecureDocEndpoint:
     """Test /v1/securedoc/generate endpoint."""
     
-    def test_valid_request(self):
-        response = client.post(
+    async def test_valid_request(self, aclient):
+        response = await aclient.post(
             "/v1/securedoc/generate",
             json={
                 "practice_id": "practice_123",
                 "task": "summarize",
                 "text": "Patient presented with symptoms on 01/15/2024"
             },
-            headers={"X-API-Key": "test-api-key"},
+            headers=_HEADERS,
         )
         assert response.status_code == 200
         data = response.json()
         assert "output_text" in data
         assert data["status"] == "success"
     
-    def test_empty_practice_id(self):
-        response = client.post(
-            "/v1/securedoc/generate",
-            json={
-                "practice_id": "",
-                "task": "summarize",
-                "text": "Some text"
-            },
-            headers={"X-API-Key": "test-api-key"},
-        )
-        assert response.status_code == 422
-    
-    def test_text_too_short(self):
-        response = client.post(
-            "/v1/securedoc/generate",
-            json={
-                "practice_id": "practice_123",
-                "task": "summarize",
-                "text": ""
-            },
-            headers={"X-API-Key": "test-api-key"},
-        )
-        assert response.status_code == 422
-    
-    def test_text_with_control_characters(self):
-        response = client.post(
+    @pytest.mark.parametrize("practice_id,text,expected", [
+        ("", "Some text", 422),
+        ("practice_123", "", 422),
+        ("practice_123", "Normal text\x00\x01 with control", 422),
+        ("practice_123", "Line one\r\n\tindented line two", 200),
+        ("practice_123", _MAX_TEXT, 200),
+        ("practice_123", _OVER_TEXT, 422),
+    ], ids=["empty_practice_id", "text_too_short", "control_characters",
+            "allowed_whitespace_controls", "text_at_max_size", "text_over_max_size"])
+    async def test_generate_validation(self, aclient, practice_id, text, expected):
+        response = await aclient.post(
             "/v1/securedoc/generate",
-            json={
-                "practice_id": "practice_123",
-                "task": "summarize",
-                "text": "Normal text\x00\x01 with control"
-            },
-            headers={"X-API-Key": "test-api-key"},
+            json={"practice_id": practice_id, "task": "summarize", "text": text},
+            headers=_HEADERS,
         )
-        assert response.status_code == 422
+        assert response.status_code == expected
     
-    def test_text_size_limit(self):
-        # Test with text at max size (50000 chars)
-        large_text = "a" * 50000
-        response = client.post(
-            "/v1/securedoc/generate",
-            json={
-                "practice_id": "practice_123",
-                "task": "summarize",
-                "text": large_text
-            },
-            headers={"X-API-Key": "test-api-key"},
+    async def test_streaming_endpoint_reidentifies(self, aclient):
+        text = "Patient Dr. Jane Smith, DOB 01/15/1980, email jane@example.com"
+        response = await aclient.post(
+            "/v1/securedoc/generate/stream",
+            json={"practice_id": "p1", "task": "summarize", "text": text},
+            headers=_HEADERS,
         )
         assert response.status_code == 200
-        
-        # Test with text over max size
-        too_large_text = "a" * 50001
-        response = client.post(
-            "/v1/securedoc/generate",
-            json={
-                "practice_id": "practice_123",
-                "task": "summarize",
-                "text": too_large_text
-            },
-            headers={"X-API-Key": "test-api-key"},
-        )
-        assert response.status_code == 422
+        assert response.headers["content-type"].startswith("text/plain")
+        # The mocked LLM echoes the anonymized prompt in chunks
+        assert response.text == text
+
+    async def test_streaming_endpoint_closes_upstream_stream(self, aclient, monkeypatch):
+        import backend.routers.securedoc as securedoc_router
+
+        closed = []
+        streams = []  # keeps the generator alive, so only an explicit aclose() closes it
+
+        async def _upstream():
+            try:
+                for chunk in ("one ", "two ", "three"):
+                    yield chunk
+            finally:
+                closed.append(True)
+
+        def _stream(prompt: str, task: str):
+            streams.append(_upstream())
+            return streams[-1]
+
+        class _FailingReidentifier(securedoc_router.StreamingReidentifier):
+            def feed(self, chunk: str) -> str:
+                if chunk == "two ":
+                    raise RuntimeError("stop early")
+                return super().feed(chunk)
+
+        monkeypatch.setattr(securedoc_router.llm_client, "generate_stream", _stream)
+        monkeypatch.setattr(securedoc_router, "StreamingReidentifier", _FailingReidentifier)
+
+        # A failure mid-stream aborts the transfer instead of ending it cleanly
+        # (Starlette may surface the error wrapped in an ExceptionGroup)
+        aborted = []
+        try:
+            await aclient.post(
+                "/v1/securedoc/generate/stream",
+                json={"practice_id": "p1", "task": "summarize", "text": "No identifiers"},
+                headers=_HEADERS,
+            )
+        except* RuntimeError as group:
+            aborted.extend(str(e) for e in group.exceptions)
+        assert aborted == ["stream aborted"]
+        # The stream stopped before draining the upstream generator, which is still closed
+        assert closed == [True]
+
+    async def test_streaming_endpoint_fails_closed_on_missing_placeholders(self, aclient, monkeypatch):
+        import backend.routers.securedoc as securedoc_router
+        from backend.services import anonymization
+
+        monkeypatch.setattr(anonymization, "FAIL_ON_MISSING_PLACEHOLDERS", True)
+        text = "Patient Dr. Jane Smith, DOB 01/15/1980"
+        body = {"practice_id": "p1", "task": "summarize", "text": text}
+
+        # Placeholders intact: the buffered response is re-identified in full
+        response = await aclient.post("/v1/securedoc/generate/stream", json=body, headers=_HEADERS)
+        assert response.status_code == 200
+        assert response.text == text
 
-    def test_missing_api_key_unauthorized(self):
-        response = client.post(
+        async def _stream(prompt: str, task: str):
+            yield "placeholders "
+            yield "dropped"
+
+        monkeypatch.setattr(securedoc_router.llm_client, "generate_stream", _stream)
+
+        # Placeholders dropped: rejected before any output is sent
+        response = await aclient.post("/v1/securedoc/generate/stream", json=body, headers=_HEADERS)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid request"
+
+    async def test_concurrent_requests_are_isolated(self, aclient):
+        import asyncio
+
+        texts = [f"Dr. Jane Smith{chr(97 + i)} DOB 01/1{i}/1980" for i in range(5)]
+        responses = await asyncio.gather(*(
+            aclient.post(
+                "/v1/securedoc/generate",
+                json={"practice_id": "p1", "task": "summarize", "text": text},
+                headers=_HEADERS,
+            )
+            for text in texts
+        ))
+        # The mocked LLM echoes the prompt, so each response must restore its own PHI
+        for text, response in zip(texts, responses):
+            assert response.status_code == 200
+            assert text in response.json()["output_text"]
+
+    async def test_missing_api_key_unauthorized(self, aclient):
+        response = await aclient.post(
             "/v1/securedoc/generate",
             json={
                 "practice_id": "practice_123",
@@ -223,7 +402,7 @@ class TestSecureDocEndpoint:
 class TestStripeWebhook:
     """Test /v1/billing/stripe/webhook endpoint."""
     
-    def test_missing_signature(self):
+    def test_missing_signature(self, client):
         response = client.post(
             "/v1/billing/stripe/webhook",
             json={"type": "test", "data": {}}
@@ -231,7 +410,7 @@ class TestStripeWebhook:
         assert response.status_code == 400
         assert "Missing Stripe signature" in response.json()["detail"]
     
-    def test_with_signature_no_secret(self):
+    def test_with_signature_no_secret(self, client):
         response = client.post(
             "/v1/billing/stripe/webhook",
             json={"type": "test", "data": {}},
@@ -240,67 +419,77 @@ class TestStripeWebhook:
         # Deterministic: secret missing fails closed.
         assert response.status_code == 500
 
-    def test_webhook_success_and_idempotency_mocked(self, monkeypatch):
+    @pytest.mark.asyncio
+    async def test_webhook_success_and_idempotency_mocked(self, aclient, monkeypatch):
         import backend.routers.billing as billing_router
 
         # Configure secret so webhook proceeds to signature verification.
-        billing_router.stripe_settings.stripe_webhook_secret = "whsec_test"
-
-        fixed_now = 1_700_000_000
-        monkeypatch.setattr(billing_router.time, "time", lambda: fixed_now, raising=True)
-
-        event = {
-            "id": "evt_test_1",
-            "type": "checkout.session.completed",
-            "created": fixed_now,
-            "data": {"object": {"id": "cs_test_1"}},
-        }
+        monkeypatch.setattr(billing_router.stripe_settings, "stripe_webhook_secret", "whsec_test")
 
-        def _construct_event(payload, sig_header, secret):
-            return event
+        monkeypatch.setattr(billing_router.time, "time", lambda: _WEBHOOK_NOW, raising=True)
+        monkeypatch.setattr(billing_router.stripe.Webhook, "construct_event", _fake_construct_event, raising=True)
 
-        monkeypatch.setattr(billing_router.stripe.Webhook, "construct_event", _construct_event, raising=True)
-
-        r1 = client.post(
-            "/v1/billing/stripe/webhook",
-            json={"any": "payload"},
-            headers={"Stripe-Signature": "t=123,v1=fake"},
-        )
+        # Both deliveries go through one in-process client; order matters, so no gather
+        r1 = await aclient.post("/v1/billing/stripe/webhook", content=_WEBHOOK_PAYLOAD, headers=_WEBHOOK_HEADERS)
         assert r1.status_code == 200
         assert r1.json()["status"] == "success"
 
         # Same event id should be treated idempotently.
-        r2 = client.post(
-            "/v1/billing/stripe/webhook",
-            json={"any": "payload"},
-            headers={"Stripe-Signature": "t=123,v1=fake"},
-        )
+        r2 = await aclient.post("/v1/billing/stripe/webhook", content=_WEBHOOK_PAYLOAD, headers=_WEBHOOK_HEADERS)
         assert r2.status_code == 200
         assert r2.json()["status"] == "success"
         assert "already processed" in r2.json().get("message", "")
 
-    def test_webhook_timestamp_outside_tolerance_mocked(self, monkeypatch):
+    def test_webhook_timestamp_outside_tolerance_mocked(self, client, monkeypatch):
         import backend.routers.billing as billing_router
 
-        billing_router.stripe_settings.stripe_webhook_secret = "whsec_test"
+        monkeypatch.setattr(billing_router.stripe_settings, "stripe_webhook_secret", "whsec_test")
 
-        now = 1_700_000_000
-        old = now - 1_000
-        monkeypatch.setattr(billing_router.time, "time", lambda: now, raising=True)
+        old = _WEBHOOK_NOW - 1_000
+        monkeypatch.setattr(billing_router.time, "time", lambda: _WEBHOOK_NOW, raising=True)
 
         def _construct_event(payload, sig_header, secret):
             return {"id": "evt_old", "type": "test", "created": old, "data": {"object": {}}}
 
         monkeypatch.setattr(billing_router.stripe.Webhook, "construct_event", _construct_event, raising=True)
 
-        r = client.post(
-            "/v1/billing/stripe/webhook",
-            json={"any": "payload"},
-            headers={"Stripe-Signature": "t=123,v1=fake"},
-        )
+        r = client.post("/v1/billing/stripe/webhook", content=_WEBHOOK_PAYLOAD, headers=_WEBHOOK_HEADERS)
         assert r.status_code == 400
         assert "tolerance" in r.json().get("detail", "")
 
+    def test_idempotency_cache_evicts_least_recently_seen(self, client, monkeypatch):
+        import json
+        import backend.routers.billing as billing_router
+
+        monkeypatch.setattr(billing_router.stripe_settings, "stripe_webhook_secret", "whsec_test")
+        monkeypatch.setattr(billing_router, "MAX_PROCESSED_EVENTS", 2, raising=True)
+        fixed_now = 1_700_000_000
+        monkeypatch.setattr(billing_router.time, "time", lambda: fixed_now, raising=True)
+
+        def _construct_event(payload, sig_header, secret):
+            event_id = json.loads(payload)["id"]
+            return {"id": event_id, "type": "test", "created": fixed_now, "data": {"object": {}}}
+
+        monkeypatch.setattr(billing_router.stripe.Webhook, "construct_event", _construct_event, raising=True)
+
+        # evt_a is replayed after evt_b, so evt_b is evicted first
+        for event_id in ("evt_a", "evt_b", "evt_a", "evt_c"):
+            r = client.post(
+                "/v1/billing/stripe/webhook",
+                json={"id": event_id},
+                headers={"Stripe-Signature": "t=123,v1=fake"},
+            )
+            assert r.status_code == 200
+
+        assert list(billing_router.processed_events) == ["evt_a", "evt_c"]
+
+    def test_lifespan_shares_stripe_http_client(self, client):
+        import backend.routers.billing as billing_router
+
+        # The session-scoped client has entered the app lifespan
+        assert billing_router.stripe.default_http_client is not None
+        assert billing_router._stripe_session is not None
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
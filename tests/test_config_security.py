@@ -6,19 +6,22 @@ Goal:
 
 Note:
 - Some modules initialize objects at import time.
-- SecureDoc auth/rate-limit helpers read env at call-time, so monkeypatch works.
+- SecureDoc auth/rate-limit settings are parsed once; tests call
+  securedoc_router._reload_config() after monkeypatching SECUREDOC_* env vars.
 """
 
 import os
 import time
+from types import SimpleNamespace
 
 import pytest
-from fastapi.testclient import TestClient
-from starlette.requests import Request
 
 import backend.main as backend_main
 import backend.routers.securedoc as securedoc_router
 
+# Auth header matching SECUREDOC_API_KEY=expected in the endpoint branch tests
+_EXPECTED_KEY_HEADERS = {"X-API-Key": "expected"}
+
 
 @pytest.fixture(autouse=True)
 def _reset_global_states():
@@ -26,31 +29,14 @@ def _reset_global_states():
     securedoc_router._rate_state.clear()
     yield
     securedoc_router._rate_state.clear()
+    # Overrides the conftest fixture: re-parse the (restored) SECUREDOC_* env so a
+    # config loaded by this test does not leak into the next one
+    securedoc_router._reload_config()
 
 
-@pytest.fixture()
-def client():
-    return TestClient(backend_main.app)
-
-
-def _make_request(client_host: str = "127.0.0.1") -> Request:
-    scope = {
-        "type": "http",
-        "http_version": "1.1",
-        "method": "POST",
-        "scheme": "http",
-        "path": "/v1/securedoc/generate",
-        "raw_path": b"/v1/securedoc/generate",
-        "query_string": b"",
-        "headers": [],
-        "client": (client_host, 12345),
-        "server": ("testserver", 80),
-    }
-
-    async def _receive():
-        return {"type": "http.request", "body": b"", "more_body": False}
-
-    return Request(scope, _receive)
+def _make_request(client_host: str = "127.0.0.1") -> SimpleNamespace:
+    # _enforce_rate_limit only reads request.client.host
+    return SimpleNamespace(client=SimpleNamespace(host=client_host))
 
 
 class TestBackendMainHelpers:
@@ -92,11 +78,13 @@ class TestSecureDocHelpers:
     def test_require_api_key_disabled_returns_empty(self, monkeypatch):
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "false")
         monkeypatch.delenv("SECUREDOC_API_KEY", raising=False)
+        securedoc_router._reload_config()
         assert securedoc_router._require_api_key(x_api_key=None) == ""
 
     def test_require_api_key_misconfigured_503(self, monkeypatch):
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
         monkeypatch.setenv("SECUREDOC_API_KEY", "")
+        securedoc_router._reload_config()
         with pytest.raises(Exception) as exc:
             securedoc_router._require_api_key(x_api_key="anything")
         # fastapi.HTTPException string repr isn't stable; assert status_code.
@@ -105,14 +93,26 @@ class TestSecureDocHelpers:
     def test_require_api_key_invalid_401(self, monkeypatch):
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
         monkeypatch.setenv("SECUREDOC_API_KEY", "expected")
+        securedoc_router._reload_config()
         with pytest.raises(Exception) as exc:
             securedoc_router._require_api_key(x_api_key="wrong")
         assert getattr(exc.value, "status_code", None) == 401
 
+    def test_require_api_key_accepts_configured_key(self, monkeypatch):
+        monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
+        monkeypatch.setenv("SECUREDOC_API_KEY", " expected ")
+        securedoc_router._reload_config()
+        assert securedoc_router._require_api_key(x_api_key="expected ") == "expected"
+        # Prefix of the key (shorter input) is still rejected
+        with pytest.raises(Exception) as exc:
+            securedoc_router._require_api_key(x_api_key="expect")
+        assert getattr(exc.value, "status_code", None) == 401
+
     def test_enforce_rate_limit_429_and_retry_after(self, monkeypatch):
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "100")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
 
         req = _make_request()
         # First call consumes the burst token.
@@ -125,22 +125,136 @@ class TestSecureDocHelpers:
         headers = getattr(exc.value, "headers", {}) or {}
         assert "Retry-After" in headers
 
+    def test_rate_limit_keys_hosts_separately_without_raw_ip(self, monkeypatch):
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "0.01")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
+
+        securedoc_router._enforce_rate_limit(_make_request("10.0.0.1"), api_key="")
+        securedoc_router._enforce_rate_limit(_make_request("10.0.0.2"), api_key="")
+
+        identities = list(securedoc_router._rate_state)
+        assert len(identities) == 2
+        assert all(isinstance(identity, int) for identity in identities)
+
+    def test_retry_after_rounds_up(self, monkeypatch):
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "0.25")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
+
+        securedoc_router._enforce_rate_limit(_make_request(), api_key="k")
+        with pytest.raises(Exception) as exc:
+            securedoc_router._enforce_rate_limit(_make_request(), api_key="k")
+        # Just under 4s until the next token: advertise 4, not 3
+        assert exc.value.headers["Retry-After"] == "4"
+
     def test_enforce_rate_limit_misconfigured_503(self, monkeypatch):
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "not-a-number")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "5")
+        securedoc_router._reload_config()
 
         req = _make_request()
         with pytest.raises(Exception) as exc:
             securedoc_router._enforce_rate_limit(req, api_key="")
         assert getattr(exc.value, "status_code", None) == 503
 
+    def test_rate_state_drops_refilled_buckets(self, monkeypatch):
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "1")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "5")
+        securedoc_router._reload_config()
+
+        # A bucket idle long enough to be full again is indistinguishable from no bucket.
+        securedoc_router._rate_state["key:idle"] = (0.0, time.monotonic() - 60)
+        securedoc_router._enforce_rate_limit(_make_request(), api_key="active")
+
+        assert list(securedoc_router._rate_state) == ["key:active"]
+
+    def test_rate_state_is_bounded(self, monkeypatch):
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "0.0001")
+        monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
+        monkeypatch.setattr(securedoc_router, "MAX_RATE_STATE_ENTRIES", 3)
+
+        for i in range(5):
+            securedoc_router._enforce_rate_limit(_make_request(), api_key=f"k{i}")
+
+        assert list(securedoc_router._rate_state) == ["key:k2", "key:k3", "key:k4"]
+
+
+class TestLLMClientHelpers:
+    def test_backoff_delay_is_jittered_and_capped(self, monkeypatch):
+        client = securedoc_router.llm_client
+        monkeypatch.setattr(client.settings, "llm_retry_delay", 1.0)
+        monkeypatch.setattr(client.settings, "llm_retry_max", 5.0)
+
+        delays = [client._backoff_delay(attempt) for attempt in range(6) for _ in range(20)]
+        assert all(1.0 <= d <= 5.0 for d in delays)
+        assert len(set(delays)) > 1
+
+    def test_generate_stream_parses_sse(self, monkeypatch):
+        import asyncio
+        import httpx
+        from backend.services import llm_client as llm_module
+
+        events = [
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            'data: {"choices": [{"delta": {"content": "Hello "}}]}',
+            "",
+            'data: {"choices": [{"delta": {"content": "[NAME_abcdef12]"}}]}',
+            "data: [DONE]",
+        ]
+
+        def _handler(request):
+            assert b'"stream"' in request.content
+            return httpx.Response(200, text="\n".join(events) + "\n")
+
+        client = llm_module.LLMClient()
+        monkeypatch.setattr(client.settings, "llm_api_key", "test-key")
+        monkeypatch.setattr(client, "_circuit_breaker", llm_module.CircuitBreaker())
+
+        async def _collect():
+            # Close the pooled default client before swapping in the mock transport
+            await client.close()
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+            try:
+                return [chunk async for chunk in client.generate_stream("prompt", "task")]
+            finally:
+                await client.close()
+
+        assert asyncio.run(_collect()) == ["Hello ", "[NAME_abcdef12]"]
+
+    def test_circuit_breaker_opens_and_half_opens(self, monkeypatch):
+        from backend.services import llm_client as llm_module
+
+        now = [1000.0]
+        monkeypatch.setattr(llm_module.time, "monotonic", lambda: now[0])
+        breaker = llm_module.CircuitBreaker(threshold=2, cooldown=30.0)
+
+        breaker.record_failure()
+        assert breaker.allow() is True
+        breaker.record_failure()
+        assert breaker.allow() is False
+
+        # After the cooldown exactly one probe goes through
+        now[0] += 31.0
+        assert breaker.allow() is True
+        assert breaker.allow() is False
+
+        breaker.record_success()
+        assert breaker.allow() is True
+
 
 class TestSecureDocEndpointBranches:
     def test_auth_misconfigured_returns_503(self, client, monkeypatch):
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
         monkeypatch.setenv("SECUREDOC_API_KEY", "")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "false")
+        securedoc_router._reload_config()
 
         resp = client.post(
             "/v1/securedoc/generate",
@@ -153,6 +267,7 @@ class TestSecureDocEndpointBranches:
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "false")
         monkeypatch.delenv("SECUREDOC_API_KEY", raising=False)
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "false")
+        securedoc_router._reload_config()
 
         resp = client.post(
             "/v1/securedoc/generate",
@@ -165,16 +280,18 @@ class TestSecureDocEndpointBranches:
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "0.0001")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
 
         # ...but auth must pass (otherwise 401/503 would win).
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
         monkeypatch.setenv("SECUREDOC_API_KEY", "expected")
+        securedoc_router._reload_config()
 
         # Invalid request body should return 422 BEFORE rate limiting.
         resp = client.post(
             "/v1/securedoc/generate",
             json={"practice_id": "", "task": "t", "text": ""},
-            headers={"X-API-Key": "expected"},
+            headers=_EXPECTED_KEY_HEADERS,
         )
         assert resp.status_code == 422
 
@@ -182,15 +299,17 @@ class TestSecureDocEndpointBranches:
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_ENABLED", "true")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_RPS", "100")
         monkeypatch.setenv("SECUREDOC_RATE_LIMIT_BURST", "1")
+        securedoc_router._reload_config()
 
         monkeypatch.setenv("SECUREDOC_REQUIRE_API_KEY", "true")
         monkeypatch.setenv("SECUREDOC_API_KEY", "expected")
+        securedoc_router._reload_config()
 
         payload = {"practice_id": "p1", "task": "t", "text": "Some text"}
 
-        r1 = client.post("/v1/securedoc/generate", json=payload, headers={"X-API-Key": "expected"})
+        r1 = client.post("/v1/securedoc/generate", json=payload, headers=_EXPECTED_KEY_HEADERS)
         assert r1.status_code == 200
 
-        r2 = client.post("/v1/securedoc/generate", json=payload, headers={"X-API-Key": "expected"})
+        r2 = client.post("/v1/securedoc/generate", json=payload, headers=_EXPECTED_KEY_HEADERS)
         assert r2.status_code == 429
         assert "Retry-After" in r2.headers